@@ -0,0 +1,285 @@
+#! /usr/bin/env python3
+# benchmarks/bench_authflow.py
+#
+# End to end signup -> verify -> signin against main.app on a throwaway
+# SQLite database and the local fake SMTP server, at several concurrency
+# levels. Results are written as JSON and can be compared with an
+# earlier run.
+#   python benchmarks/bench_authflow.py --concurrency 1,8,32 --flows 200 --output run.json
+#   python benchmarks/bench_authflow.py --output new.json --baseline run.json
+#   python benchmarks/bench_authflow.py --transport uvicorn
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakesmtp import FakeSMTPServer
+
+STEPS = ("signup", "verify", "signin", "flow")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def summarize(samples, errors, elapsed):
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "rps": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+# accumulated time spent in the database, bcrypt and SMTP, in-process only
+class Breakdown:
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, name, seconds):
+        self.totals[name] += seconds
+        self.counts[name] += 1
+
+    def install(self, main):
+        from sqlalchemy import event
+
+        from hashing import hash_pool
+
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("bench_started", []).append(time.perf_counter())
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            self.add("db", time.perf_counter() - conn.info["bench_started"].pop())
+
+        import connection
+        engines = {connection.async_engine.sync_engine, connection.async_write_engine.sync_engine,
+                   connection.engine, connection.write_engine}
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", before)
+            event.listen(engine, "after_cursor_execute", after)
+
+        def timed_async(name, fn):
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.add(name, time.perf_counter() - started)
+            return wrapper
+
+        def timed(name, fn):
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.add(name, time.perf_counter() - started)
+            return wrapper
+
+        hash_pool.hash = timed_async("bcrypt", hash_pool.hash)
+        hash_pool.verify = timed_async("bcrypt", hash_pool.verify)
+        main.mail_queue.pool.send = timed("smtp", main.mail_queue.pool.send)
+
+    def snapshot(self):
+        return dict(self.totals), dict(self.counts)
+
+    @staticmethod
+    def diff(before, after, flows):
+        totals, counts = after[0], after[1]
+        return {name: {"total_ms": (totals[name] - before[0].get(name, 0.0)) * 1000,
+                       "per_flow_ms": (totals[name] - before[0].get(name, 0.0)) * 1000 / max(1, flows),
+                       "calls": counts[name] - before[1].get(name, 0)}
+                for name in totals}
+
+
+class Mailbox:
+    def __init__(self, server: FakeSMTPServer):
+        self.server = server
+        self.seen = 0
+        self.tokens = {}
+
+    async def token_for(self, recipient, timeout=30.0):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            messages = self.server.messages
+            while self.seen < len(messages):
+                _, recipients, message = messages[self.seen]
+                self.seen += 1
+                body = message.get_payload(decode=True).decode()
+                token = body.split("/user/verify/", 1)[1].split()[0]
+                for to in recipients:
+                    self.tokens[to] = token
+            if recipient in self.tokens:
+                return self.tokens.pop(recipient)
+            await asyncio.sleep(0.005)
+        raise TimeoutError(f"no verification email for {recipient}")
+
+
+async def run_level(client, mailbox, concurrency, flows, prefix):
+    samples = {step: [] for step in STEPS}
+    errors = defaultdict(int)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def flow(i):
+        username = f"{prefix}-{i}"
+        email = f"{username}@bench.local"
+        async with sem:
+            started = time.perf_counter()
+            try:
+                t = time.perf_counter()
+                r = await client.post("/signupuser", data={"username": username, "email": email, "password": "bench-pass"})
+                samples["signup"].append(time.perf_counter() - t)
+                if r.status_code != 200:
+                    errors["signup"] += 1
+                    return
+                token = await mailbox.token_for(email)
+                t = time.perf_counter()
+                r = await client.get(f"/user/verify/{token}", follow_redirects=False)
+                samples["verify"].append(time.perf_counter() - t)
+                if r.status_code >= 400:
+                    errors["verify"] += 1
+                    return
+                t = time.perf_counter()
+                r = await client.post("/signinuser", data={"username": username, "password": "bench-pass"})
+                samples["signin"].append(time.perf_counter() - t)
+                if r.status_code != 200:
+                    errors["signin"] += 1
+                    return
+                samples["flow"].append(time.perf_counter() - started)
+            except Exception:
+                errors["flow"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(flow(i) for i in range(flows)))
+    elapsed = time.perf_counter() - started
+    return {step: summarize(samples[step], errors[step], elapsed) for step in STEPS}, elapsed
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(client, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def run(args, levels):
+    import httpx
+
+    mailbox = Mailbox(FakeSMTPServer().start())
+    env = {
+        "DATABASE_URL": "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(mailbox.server.port),
+        "SMTP_USE_SSL": "0", "SMTP_PASSWORD_FILE": "",
+        "BCRYPT_ROUNDS": str(args.rounds), "RATE_LIMIT_ENABLED": "0",
+    }
+    os.environ.update(env)
+    results = {"transport": args.transport, "rounds": args.rounds, "flows": args.flows,
+               "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "levels": {}}
+    run_id = str(int(time.time()))
+    process = None
+    try:
+        if args.transport == "uvicorn":
+            port = free_port()
+            process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                        "--log-level", "warning"], cwd=ROOT, env=dict(os.environ))
+            client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60)
+            breakdown = None
+            lifespan = None
+        else:
+            os.chdir(ROOT)
+            import main
+            breakdown = Breakdown()
+            breakdown.install(main)
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=60)
+            lifespan = main.app.router.lifespan_context(main.app)
+            await lifespan.__aenter__()
+        async with client:
+            await wait_ready(client)
+            for concurrency in levels:
+                before = breakdown.snapshot() if breakdown else None
+                stats, elapsed = await run_level(client, mailbox, concurrency, args.flows, f"b{run_id}c{concurrency}")
+                level = {"elapsed_s": elapsed, "steps": stats}
+                if breakdown:
+                    level["breakdown"] = Breakdown.diff(before, breakdown.snapshot(), stats["flow"]["count"])
+                results["levels"][str(concurrency)] = level
+                report_level(concurrency, level)
+        if lifespan:
+            await lifespan.__aexit__(None, None, None)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        mailbox.server.stop()
+    return results
+
+
+def report_level(concurrency, level):
+    print(f"\nconcurrency {concurrency} ({level['elapsed_s']:.1f}s)")
+    print(f"  {'step':<8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for step, s in level["steps"].items():
+        print(f"  {step:<8} {s['rps']:>9.1f} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['errors']:>7}")
+    for name, b in sorted(level.get("breakdown", {}).items()):
+        print(f"  {name:<8} {b['per_flow_ms']:>9.1f} ms/flow over {b['calls']} calls")
+
+
+def compare(results, baseline):
+    print("\nagainst baseline (flow req/s, flow p95)")
+    for concurrency, level in results["levels"].items():
+        old = baseline.get("levels", {}).get(concurrency)
+        if not old:
+            continue
+        new_flow, old_flow = level["steps"]["flow"], old["steps"]["flow"]
+        rps = (new_flow["rps"] / old_flow["rps"] - 1) * 100 if old_flow["rps"] else 0.0
+        p95 = (new_flow["p95_ms"] / old_flow["p95_ms"] - 1) * 100 if old_flow["p95_ms"] else 0.0
+        print(f"  concurrency {concurrency:>4}: req/s {rps:+.1f}%  p95 {p95:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="signup -> verify -> signin benchmark")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated concurrency levels")
+    parser.add_argument("--flows", type=int, default=100, help="flows per concurrency level")
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt rounds")
+    parser.add_argument("--transport", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results from an earlier run")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    results = asyncio.run(run(args, levels))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
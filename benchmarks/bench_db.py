@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+# benchmarks/bench_db.py
+#
+# user lookups per second through the sync session (threadpool) and the
+# async session (event loop), on a throwaway database.
+#   python benchmarks/bench_db.py --users 10000 --lookups 5000 --concurrency 50
+#   DATABASE_URL=postgresql://app@localhost/bench python benchmarks/bench_db.py
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+# both passes look up the same names, a cache would turn the second into hits
+os.environ["USER_CACHE_BACKEND"] = "none"
+
+from anyio import to_thread
+
+from connection import Base, engine, async_engine, SessionFactory, AsyncSessionFactory
+from models import UserModel
+from repositoryuser import UserRepository, AsyncUserRepository
+
+
+def populate(count):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with SessionFactory() as db:
+        db.execute(UserModel.__table__.insert(), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": f"hash{i}", "is_active": True}
+            for i in range(count)
+        ])
+        db.commit()
+
+
+def sync_lookup(username):
+    with SessionFactory() as db:
+        return UserRepository(db).get_user_by_username(username)
+
+
+async def async_lookup(username):
+    async with AsyncSessionFactory() as db:
+        return await AsyncUserRepository(db).get_user_by_username(username)
+
+
+async def run(lookup, names, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(name):
+        async with sem:
+            assert await lookup(name) is not None
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(name) for name in names))
+    return len(names) / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="sync vs async user lookups")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    populate(args.users)
+    names = [f"user{random.randrange(args.users)}" for _ in range(args.lookups)]
+
+    sync_rate = await run(lambda name: to_thread.run_sync(sync_lookup, name), names, args.concurrency)
+    async_rate = await run(async_lookup, names, args.concurrency)
+    await async_engine.dispose()
+
+    print(f"database: {engine.url.render_as_string()}")
+    print(f"sync session in threadpool: {sync_rate:>10.1f} lookups/s")
+    print(f"async session on the loop:  {async_rate:>10.1f} lookups/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+# benchmarks/bench_hashing.py
+#
+# bcrypt verifications per second through HashPool for a growing number
+# of workers, i.e. how login throughput scales with cores.
+#   python benchmarks/bench_hashing.py --rounds 10 --requests 200
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passlib.context import CryptContext
+
+from hashing import HashPool, HashPoolBusy
+
+
+async def run(pool, hashed, requests, concurrency):
+    done = rejected = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal done, rejected
+        async with sem:
+            try:
+                assert await pool.verify("secret", hashed)
+                done += 1
+            except HashPoolBusy:
+                rejected += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return done, rejected, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bcrypt throughput by worker count")
+    parser.add_argument("--rounds", type=int, default=int(os.environ.get("BCRYPT_ROUNDS", 12)))
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--kind", choices=["process", "thread"], default="process")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    # workers hash with the rounds from their own environment
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    hashed = CryptContext(schemes=["bcrypt"], bcrypt__rounds=args.rounds).hash("secret")
+
+    workers = 1
+    print(f"bcrypt rounds={args.rounds} executor={args.kind} cores={os.cpu_count()}")
+    print(f"{'workers':>8} {'verify/s':>10} {'rejected':>9}")
+    while workers <= args.max_workers:
+        pool = HashPool(workers=workers, max_pending=args.concurrency, kind=args.kind)
+        pool.start()
+        try:
+            # warm up so process start-up is not counted
+            asyncio.run(run(pool, hashed, workers, workers))
+            done, rejected, elapsed = asyncio.run(run(pool, hashed, args.requests, args.concurrency))
+        finally:
+            pool.shutdown()
+        print(f"{workers:>8} {done / elapsed:>10.1f} {rejected:>9}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
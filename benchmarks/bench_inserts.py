@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+# benchmarks/bench_inserts.py
+#
+# user insert throughput with the old index set (unique index on the
+# password hash, extra index on the primary key) against the current
+# schema, on throwaway SQLite files.
+#   python benchmarks/bench_inserts.py --rows 20000 --batch 1
+
+import argparse
+import os
+import secrets
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Boolean, Column, Enum, Integer, MetaData, String, Table, create_engine
+
+from connection import tune_engine
+from models import UserModel
+from schema import Roles
+
+legacy_users = Table(
+    "users", MetaData(),
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String, unique=True, index=True),
+    Column("username", String, unique=True, index=True),
+    Column("password", String, unique=True, index=True),
+    Column("is_active", Boolean, default=False),
+    Column("role", Enum(Roles), default=Roles.user),
+)
+
+
+def fake_hash():
+    # same length and alphabet spread as a bcrypt hash
+    return "$2b$12$" + secrets.token_urlsafe(40)[:53]
+
+
+def run(table, rows, batch):
+    engine = tune_engine(create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")))
+    table.create(engine)
+    values = [{"username": f"user{i}", "email": f"user{i}@example.com", "password": fake_hash(),
+               "is_active": False, "role": Roles.user} for i in range(rows)]
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        for i in range(0, rows, batch):
+            conn.execute(table.insert(), values[i:i + batch])
+            conn.commit()
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(engine.url.database)
+    engine.dispose()
+    return rows / elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="insert throughput, old vs new users indexes")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=1, help="rows per transaction")
+    args = parser.parse_args()
+
+    print(f"{'schema':>8} {'rows/s':>10} {'file size':>12}")
+    for name, table in (("legacy", legacy_users), ("current", UserModel.__table__)):
+        rate, size = run(table, args.rows, args.batch)
+        print(f"{name:>8} {rate:>10.0f} {size / 1024:>10.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#! /usr/bin/env python3
+# benchmarks/bench_jwt.py
+#
+# token verifications per second: python-jose, PyJWT, and verify_token
+# with the verified-token cache warm.
+#   python benchmarks/bench_jwt.py --iterations 20000
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scurity import JWT_ALGORITHM, JWT_SECRET, create_access_token, verify_token
+from schema import Roles
+from tokens import JoseBackend, PyJWTBackend
+from usercache import UserRecord
+
+
+def rate(fn, token, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(token)
+    return iterations / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JWT verifications per second")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    user = UserRecord(1, "bench", "bench@example.com", "x", True, Roles.user)
+    token = create_access_token(user)
+
+    candidates = [("python-jose decode", JoseBackend())]
+    try:
+        candidates.append(("PyJWT decode", PyJWTBackend()))
+    except ImportError:
+        pass
+
+    for name, backend in candidates:
+        print(f"{name:>22}: {rate(lambda t: backend.decode(t, JWT_SECRET, JWT_ALGORITHM), token, args.iterations):>10.0f}/s")
+    verify_token(token)
+    print(f"{'verify_token (cached)':>22}: {rate(verify_token, token, args.iterations):>10.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
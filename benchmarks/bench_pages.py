@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+# benchmarks/bench_pages.py
+#
+# requests per second for the public pages through the ASGI app, with
+# per-request rendering, with the page cache, and with revalidation (304).
+#   python benchmarks/bench_pages.py --requests 2000 --concurrency 20
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import httpx
+
+import main
+from rendering import page_cache
+
+PATHS = ("/", "/about", "/user/signin", "/user/signup", main.static_assets.url("style.css"))
+
+
+async def load(client, path, requests, concurrency, headers):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            r = await client.get(path, headers=headers)
+            assert r.status_code in (200, 304), r.status_code
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - started)
+
+
+async def run(args):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'path':>32} {'render':>9} {'cached':>9} {'304':>9}  (req/s)")
+        for path in PATHS:
+            etag = (await client.get(path)).headers["etag"]
+            page_cache.enabled = False
+            uncached = await load(client, path, args.requests, args.concurrency, {"accept-encoding": "gzip"})
+            page_cache.enabled = True
+            cached = await load(client, path, args.requests, args.concurrency, {"accept-encoding": "gzip"})
+            revalidated = await load(client, path, args.requests, args.concurrency, {"if-none-match": etag})
+            print(f"{path:>32} {uncached:>9.0f} {cached:>9.0f} {revalidated:>9.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="public page throughput")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
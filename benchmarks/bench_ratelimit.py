@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+# benchmarks/bench_ratelimit.py
+#
+# a legitimate user signing in while a credential-stuffing load hammers
+# /signinuser from a handful of IPs, with the rate limiter off and on.
+# The app runs under uvicorn in its own process, so the load generator
+# never shares an event loop with the server; attackers connect from
+# other loopback addresses (127.0.1.x) to get their own limiter buckets.
+# Legit latency is only recorded after --warmup seconds of attack, once
+# the attackers have spent the burst their buckets start with.
+#   python benchmarks/bench_ratelimit.py --seconds 10 --warmup 10 --attackers 50
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_authflow import free_port, percentile, wait_ready
+
+
+def seed(args):
+    from connection import write_engine
+    from hashing import hash_password
+    from migrations import upgrade
+    from models import UserModel
+
+    upgrade()
+    hashed = hash_password("right")
+    with write_engine.begin() as conn:
+        conn.execute(UserModel.__table__.insert(), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": hashed, "is_active": True}
+            for i in range(args.users)
+        ] + [{"username": "legit", "email": "legit@example.com", "password": hashed, "is_active": True}])
+
+
+async def scenario(args, base_url):
+    import httpx
+
+    def client(ip):
+        transport = httpx.AsyncHTTPTransport(local_address=ip)
+        return httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60)
+
+    async with client("127.0.0.1") as c:
+        await wait_ready(c)
+
+    measure_from = time.perf_counter() + args.warmup
+    deadline = measure_from + args.seconds
+    attack = {"requests": 0, "rejected": 0}
+    latencies, outcomes = [], {}
+
+    async def attacker(n):
+        async with client(f"127.0.1.{n % args.attacker_ips + 1}") as c:
+            while time.perf_counter() < deadline:
+                r = await c.post("/signinuser", data={"username": f"user{random.randrange(args.users)}", "password": "guess"})
+                if time.perf_counter() >= measure_from:
+                    attack["requests"] += 1
+                    attack["rejected"] += r.status_code == 429
+
+    async def legit():
+        await asyncio.sleep(args.warmup)
+        async with client("127.0.0.1") as c:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                r = await c.post("/signinuser", data={"username": "legit", "password": "right"})
+                latencies.append(time.perf_counter() - started)
+                outcomes[r.status_code] = outcomes.get(r.status_code, 0) + 1
+                await asyncio.sleep(0.2)
+
+    await asyncio.gather(legit(), *(attacker(n) for n in range(args.attackers)))
+    return {
+        "attack_rps": attack["requests"] / args.seconds,
+        "attack_rejected": attack["rejected"],
+        "legit_count": len(latencies),
+        "legit_p50_ms": percentile(latencies, 50) * 1000,
+        "legit_p95_ms": percentile(latencies, 95) * 1000,
+        "legit_outcomes": outcomes,
+    }
+
+
+def run_mode(args, enabled):
+    env = dict(os.environ, RATE_LIMIT_ENABLED=enabled, BCRYPT_ROUNDS=str(args.rounds),
+               USER_CACHE_BACKEND="none", SMTP_PASSWORD_FILE="",
+               DATABASE_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+    subprocess.run([sys.executable, __file__, "--seed"] + sys.argv[1:], env=env, cwd=ROOT, check=True)
+    port = free_port()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                "--log-level", "warning", "--no-access-log"], cwd=ROOT, env=env)
+    try:
+        return asyncio.run(scenario(args, f"http://127.0.0.1:{port}"))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="legit sign-in latency under credential stuffing")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=10, help="attack seconds before measuring")
+    parser.add_argument("--attackers", type=int, default=50)
+    parser.add_argument("--attacker-ips", type=int, default=5)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt rounds")
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        return seed(args)
+
+    for enabled in ("0", "1"):
+        result = run_mode(args, enabled)
+        print(f"limiter {'on ' if enabled == '1' else 'off'}: attack {result['attack_rps']:.0f} req/s "
+              f"({result['attack_rejected']} rejected), legit sign-in p50 {result['legit_p50_ms']:.0f} ms "
+              f"p95 {result['legit_p95_ms']:.0f} ms over {result['legit_count']}, "
+              f"outcomes {result['legit_outcomes']}")
+
+
+if __name__ == "__main__":
+    main()
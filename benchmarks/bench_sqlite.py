@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# benchmarks/bench_sqlite.py
+#
+# mixed read/write load against a throwaway SQLite file, once with the
+# stock settings (SQLITE_TUNING=0) and once with WAL, pragmas and the
+# one-connection sync writer pool.
+#   python benchmarks/bench_sqlite.py --readers 8 --writers 4 --seconds 5
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def worker_main(args):
+    from sqlalchemy import update
+    from sqlalchemy.exc import OperationalError
+
+    from connection import Base, engine, SessionFactory
+    from models import UserModel
+    from repositoryuser import UserRepository
+
+    Base.metadata.create_all(bind=engine)
+    with SessionFactory() as db:
+        db.execute(UserModel.__table__.insert(), [
+            {"username": f"seed{i}", "email": f"seed{i}@example.com", "password": f"hash{i}"}
+            for i in range(args.users)
+        ])
+        db.commit()
+
+    counts = {"reads": 0, "writes": 0, "failed": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def reader(n):
+        i = n
+        while time.perf_counter() < deadline:
+            with SessionFactory() as db:
+                UserRepository(db).get_user_by_username(f"seed{i % args.users}")
+            count("reads")
+            i += 7
+
+    def writer(n):
+        i = 0
+        while time.perf_counter() < deadline:
+            name = f"w{n}-{i}"
+            i += 1
+            with SessionFactory() as db:
+                # signup followed by verification, as the app does
+                userRepository = UserRepository(db)
+                if not userRepository.create_user(UserModel(username=name, email=f"{name}@example.com", password=name)):
+                    count("failed")
+                    continue
+                try:
+                    db.execute(update(UserModel).where(UserModel.username == name).values(is_active=True))
+                    db.commit()
+                except OperationalError:
+                    count("failed")
+                    continue
+            count("writes")
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({k: v / elapsed if k != "failed" else v for k, v in counts.items()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite concurrency before/after tuning")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker_main(args)
+
+    print(f"{'mode':>8} {'reads/s':>10} {'writes/s':>10} {'failed':>8}")
+    for mode, tuning in (("stock", "0"), ("tuned", "1")):
+        # no user cache, so every read reaches SQLite
+        env = dict(os.environ, SQLITE_TUNING=tuning, USER_CACHE_BACKEND="none",
+                   DATABASE_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+        out = subprocess.run([sys.executable, __file__, "--worker"] + sys.argv[1:],
+                             env=env, cwd=ROOT, stdout=subprocess.PIPE, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:>8} {result['reads']:>10.1f} {result['writes']:>10.1f} {result['failed']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+# benchmarks/bench_startup.py
+#
+# time from launching the server to the first successful request, for
+# python -m serve (one worker) and a plain uvicorn main:app, each on a
+# fresh throwaway SQLite database.
+#   python benchmarks/bench_startup.py --runs 5
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "serve": lambda port: [sys.executable, "-m", "serve", "--workers", "1", "--port", str(port),
+                           "--log-level", "warning", "--no-access-log"],
+    "uvicorn": lambda port: [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--log-level", "warning", "--no-access-log"],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def first_request(name, timeout=60.0):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"),
+               JWT_SECRET="bench", SMTP_PASSWORD_FILE="")
+    started = time.perf_counter()
+    process = subprocess.Popen(COMMANDS[name](port), cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"{name} did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        output, _ = process.communicate()
+        report = [line for line in output.splitlines() if line.startswith(("startup", "serve:"))]
+        if report:
+            print("   " + "\n   ".join(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time to first request")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--only", choices=sorted(COMMANDS), help="measure a single launcher")
+    args = parser.parse_args()
+
+    for name in ([args.only] if args.only else COMMANDS):
+        times = []
+        for _ in range(args.runs):
+            times.append(first_request(name))
+        print(f"{name:<8} median {statistics.median(times) * 1000:.0f} ms, "
+              f"min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms over {len(times)} runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 #! /usr/bin/env python3
  # connection.py
 
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event, Insert, Update, Delete
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from typing import Optional
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import Optional, Tuple, Dict, Any
+
+from metrics import instrument_engine
 
 # SQLALCHEMY_DATABASE_URL = "sqlite:///users.db"
 #
@@ -12,16 +18,107 @@ from typing import Optional
 #     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 # )
 
-dbcon = 'sqlite:///fastapi_users.db'
+DATABASE_URL: Optional[str] = os.environ.get("DATABASE_URL", "sqlite:///fastapi_users.db")
+SECRET_KEY: Optional[str] = "cairocoders"
 
-engine = create_engine(dbcon)
-SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# engine options that may be given as query parameters of DATABASE_URL,
+# e.g. postgresql://app@db/users?pool_size=20&max_overflow=10&pool_pre_ping=1
+POOL_OPTIONS = {
+    "pool_size": int,
+    "max_overflow": int,
+    "pool_timeout": float,
+    "pool_recycle": int,
+    "pool_pre_ping": lambda value: value.lower() in ("1", "true", "yes"),
+}
 
-Base = declarative_base()
-Base.metadata.create_all(bind=engine)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
 
-DATABASE_URL: Optional[str] = None
-SECRET_KEY: Optional[str] = "cairocoders"
+def parse_database_url(database_url: str) -> Tuple[URL, Dict[str, Any]]:
+    url = make_url(database_url)
+    options = {name: POOL_OPTIONS[name](url.query[name]) for name in POOL_OPTIONS if name in url.query}
+    return url.difference_update_query(POOL_OPTIONS), options
+
+def async_url(url: URL) -> URL:
+    backend, _, driver = url.drivername.partition("+")
+    if driver in ("aiosqlite", "asyncpg", "aiomysql", "asyncmy", "psycopg"):
+        return url
+    return url.set(drivername=ASYNC_DRIVERS.get(backend, url.drivername))
+
+def is_sqlite_file(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+# SQLite tuning applied to every new connection, SQLITE_TUNING=0 turns it off
+SQLITE_TUNING = os.environ.get("SQLITE_TUNING", "1") == "1"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64000)),  # negative is KiB
+}
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def tune_engine(sync_engine):
+    if SQLITE_TUNING and sync_engine.url.get_backend_name() == "sqlite":
+        event.listen(sync_engine, "connect", apply_sqlite_pragmas)
+    return sync_engine
+
+# SQLite allows one writer at a time; sending every flush and DML
+# statement through a one-connection writer pool makes writers on the
+# same engine queue in the pool, while reads keep the regular pool.
+# That is one writer per engine, not per process: the sync write_engine
+# (mail worker threads, outbox sender, sweeper, migrations) and the
+# async_write_engine (request handlers) each hold their own connection,
+# and contention between the two, or between worker processes, is left
+# to busy_timeout
+def routing_session(reader, writer):
+    class RoutingSession(Session):
+        def get_bind(self, mapper=None, clause=None, **kw):
+            if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+                return writer
+            return reader
+    return RoutingSession
+
+dburl, pool_options = parse_database_url(DATABASE_URL)
+dbcon = dburl.render_as_string(hide_password=False)
+single_writer = SQLITE_TUNING and is_sqlite_file(dburl) and os.environ.get("SQLITE_SINGLE_WRITER", "1") == "1"
+writer_options = {"pool_size": 1, "max_overflow": 0, "pool_timeout": pool_options.get("pool_timeout", 30)}
+
+engine = instrument_engine(tune_engine(create_engine(dburl, **pool_options)), "read")
+write_engine = (instrument_engine(tune_engine(create_engine(dburl, **writer_options)), "write")
+                if single_writer else engine)
+SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine,
+                              class_=routing_session(engine, write_engine))
+
+# aiosqlite defaults to NullPool, which opens a connection and a thread per session
+async_pool_options = dict(pool_options)
+if is_sqlite_file(dburl):
+    async_pool_options["poolclass"] = AsyncAdaptedQueuePool
+async_engine = create_async_engine(async_url(dburl), **async_pool_options)
+instrument_engine(tune_engine(async_engine.sync_engine), "async_read")
+if single_writer:
+    async_write_engine = create_async_engine(async_url(dburl), poolclass=AsyncAdaptedQueuePool, **writer_options)
+    instrument_engine(tune_engine(async_write_engine.sync_engine), "async_write")
+else:
+    async_write_engine = async_engine
+AsyncSessionFactory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False,
+                                         sync_session_class=routing_session(async_engine.sync_engine,
+                                                                            async_write_engine.sync_engine))
+
+# tables are created by migrations.upgrade(), from the app lifespan or serve.py
+Base = declarative_base()
 
 def sess_db():
     db = SessionFactory()
@@ -29,3 +126,7 @@ def sess_db():
         yield db
     finally:
         db.close()
+
+async def async_sess_db():
+    async with AsyncSessionFactory() as db:
+        yield db
@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+# fakesmtp.py
+#
+# Local stand-in for the mail server, accepts any login and keeps
+# the messages in memory. Run it and point the app at it with
+#   SMTP_HOST=127.0.0.1 SMTP_PORT=1025 SMTP_USE_SSL=0 SMTP_PASSWORD_FILE= uvicorn main:app
+
+import argparse
+import asyncio
+import threading
+from email import message_from_bytes
+
+
+def _address(command: str) -> str:
+    return command.partition("<")[2].partition(">")[0]
+
+
+class FakeSMTPServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, verbose: bool = False):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.verbose = verbose
+        self.messages = []
+        self.connections = 0
+        self._writers = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._task = None
+        self._ready = threading.Event()
+
+    async def _reply(self, writer, line: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(line.encode() + b"\r\n")
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        await self._reply(writer, "220 fakesmtp ready")
+        sender, recipients = None, []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    writer.write(b"250-fakesmtp\r\n250-AUTH PLAIN LOGIN\r\n")
+                    await self._reply(writer, "250 8BITMIME")
+                elif verb == "HELO":
+                    await self._reply(writer, "250 fakesmtp")
+                elif verb == "AUTH":
+                    parts = command.split()
+                    mechanism = parts[1].upper() if len(parts) > 1 else ""
+                    if mechanism == "LOGIN":
+                        steps = 1 if len(parts) > 2 else 2
+                        for prompt in ["VXNlcm5hbWU6", "UGFzc3dvcmQ6"][2 - steps:]:
+                            await self._reply(writer, f"334 {prompt}")
+                            await reader.readline()
+                    elif len(parts) < 3:
+                        await self._reply(writer, "334 ")
+                        await reader.readline()
+                    await self._reply(writer, "235 Authentication successful")
+                elif verb == "MAIL":
+                    sender, recipients = _address(command), []
+                    await self._reply(writer, "250 OK")
+                elif verb == "RCPT":
+                    recipients.append(_address(command))
+                    await self._reply(writer, "250 OK")
+                elif verb == "DATA":
+                    await self._reply(writer, "354 End data with <CR><LF>.<CR><LF>")
+                    data = []
+                    while True:
+                        chunk = await reader.readline()
+                        if not chunk or chunk == b".\r\n":
+                            break
+                        data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                    message = message_from_bytes(b"".join(data))
+                    self.messages.append((sender, recipients, message))
+                    if self.verbose:
+                        print(f"{sender} -> {', '.join(recipients)}: {message['Subject']}")
+                    await self._reply(writer, "250 OK queued")
+                elif verb in ("RSET", "NOOP"):
+                    await self._reply(writer, "250 OK")
+                elif verb == "QUIT":
+                    await self._reply(writer, "221 Bye")
+                    break
+                else:
+                    await self._reply(writer, "502 Command not implemented")
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    # run in a background thread, returns once the port is bound
+    def start(self):
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._task = self._loop.create_task(self.serve())
+            try:
+                self._loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="fakesmtp", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    # close every open session, as a server restart or idle timeout would
+    def drop_connections(self):
+        def drop():
+            for writer in list(self._writers):
+                writer.close()
+        self._loop.call_soon_threadsafe(drop)
+
+    def stop(self):
+        if self._loop and self._task:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        if self._thread:
+            self._thread.join(5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake SMTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each reply")
+    args = parser.parse_args()
+
+    server = FakeSMTPServer(args.host, args.port, args.latency, verbose=True)
+    print(f"Fake SMTP server listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+# hashing.py
+#
+# bcrypt runs in its own bounded pool so a burst of logins cannot take
+# every threadpool slot; kept free of app imports so spawned workers start fast
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+HASH_EXECUTOR = os.environ.get("HASH_EXECUTOR", "process")  # process | thread
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1))
+HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", HASH_WORKERS * 8))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+class HashPool:
+    def __init__(self, workers: int = HASH_WORKERS, max_pending: int = HASH_MAX_PENDING,
+                 kind: str = HASH_EXECUTOR):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.kind = kind
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            # spawn, the app process already runs threads (mail workers, db pool)
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            # start every worker now rather than on the first logins
+            for future in [self._executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+        else:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="bcrypt")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    # admission control: fail fast instead of queueing behind max_pending hashes
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashPoolBusy("password hashing pool is saturated")
+        self.start()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(check_password, plain_password, hashed_password)
+
+
+hash_pool = HashPool()
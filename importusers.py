@@ -0,0 +1,179 @@
+#! /usr/bin/env python3
+# importusers.py
+#
+# Idempotent bulk import of users from CSV (header: username,email,password)
+# or JSONL ({"username": ..., "email": ..., "password": ...}). Rows whose
+# username or email already exist are skipped and reported, so an
+# interrupted import can simply be run again.
+#   python importusers.py users.csv --batch-size 2000 --report conflicts.jsonl
+#   python importusers.py users.jsonl --hashed --active
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List
+
+from sqlalchemy import select, or_
+
+from connection import write_engine
+from models import UserModel
+from repositoryuser import insert_ignore
+from schema import Roles
+from hashing import hash_password
+from migrations import upgrade
+
+FIELDS = ("username", "email", "password")
+
+
+def read_rows(path: str) -> Iterator[Dict]:
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield dict(json.loads(line), line=line_no)
+        else:
+            for line_no, row in enumerate(csv.DictReader(f), 2):
+                yield dict(row, line=line_no)
+
+
+def batches(rows, size: int) -> Iterator[List[Dict]]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Importer:
+    def __init__(self, executor=None, workers: int = 1, hashed: bool = False, active: bool = False, report=None):
+        self.executor = executor
+        self.workers = workers
+        self.hashed = hashed
+        self.active = active
+        self.report = report
+        self.inserted = 0
+        self.conflicts = 0
+        self.invalid = 0
+        self.dialect = write_engine.dialect.name
+
+    def conflict(self, row: Dict, reason: str):
+        if reason == "invalid":
+            self.invalid += 1
+        else:
+            self.conflicts += 1
+        if self.report:
+            self.report.write(json.dumps({"line": row.get("line"), "username": row.get("username"),
+                                          "email": row.get("email"), "reason": reason}) + "\n")
+
+    # drop rows that are malformed, repeated within the batch or already stored
+    def filter_batch(self, conn, batch: List[Dict]) -> List[Dict]:
+        fresh, usernames, emails = [], set(), set()
+        for row in batch:
+            if not all(row.get(field) for field in FIELDS):
+                self.conflict(row, "invalid")
+            elif row["username"] in usernames:
+                self.conflict(row, "duplicate username")
+            elif row["email"] in emails:
+                self.conflict(row, "duplicate email")
+            else:
+                usernames.add(row["username"])
+                emails.add(row["email"])
+                fresh.append(row)
+        if not fresh:
+            return fresh
+
+        existing = conn.execute(
+            select(UserModel.username, UserModel.email)
+            .where(or_(UserModel.username.in_(usernames), UserModel.email.in_(emails)))
+        ).all()
+        taken_usernames = {r.username for r in existing}
+        taken_emails = {r.email for r in existing}
+        rows = []
+        for row in fresh:
+            if row["username"] in taken_usernames:
+                self.conflict(row, "username exists")
+            elif row["email"] in taken_emails:
+                self.conflict(row, "email exists")
+            else:
+                rows.append(row)
+        return rows
+
+    def hash_batch(self, rows: List[Dict]) -> List[str]:
+        passwords = [row["password"] for row in rows]
+        if self.hashed:
+            return passwords
+        if self.executor is None:
+            return [hash_password(p) for p in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self.executor.map(hash_password, passwords, chunksize=chunksize))
+
+    def import_batch(self, batch: List[Dict]):
+        with write_engine.connect() as conn:
+            rows = self.filter_batch(conn, batch)
+        if not rows:
+            return
+        hashes = self.hash_batch(rows)
+        values = [{"username": row["username"], "email": row["email"], "password": password,
+                   "is_active": self.active, "role": Roles.user}
+                  for row, password in zip(rows, hashes)]
+        stmt = insert_ignore(self.dialect)
+        with write_engine.begin() as conn:
+            if self.dialect in ("sqlite", "postgresql"):
+                # rows missing from RETURNING lost a race with another writer
+                inserted = set(conn.execute(stmt.returning(UserModel.username), values).scalars())
+                for row in rows:
+                    if row["username"] not in inserted:
+                        self.conflict(row, "conflict on insert")
+                self.inserted += len(inserted)
+            else:
+                self.inserted += conn.execute(stmt, values).rowcount
+
+    def run(self, rows, batch_size: int, progress_every: int = 10):
+        started = time.perf_counter()
+        for n, batch in enumerate(batches(rows, batch_size), 1):
+            self.import_batch(batch)
+            if n % progress_every == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{self.inserted} inserted, {self.conflicts} conflicts, {self.invalid} invalid, "
+                      f"{self.inserted / elapsed:.0f} rows/s", file=sys.stderr)
+        return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import users from CSV or JSONL")
+    parser.add_argument("path", help="a .csv file, or a .jsonl/.ndjson file")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="bcrypt processes")
+    parser.add_argument("--hashed", action="store_true", help="passwords are already bcrypt hashes")
+    parser.add_argument("--active", action="store_true", help="mark imported users as verified")
+    parser.add_argument("--report", help="write per-row conflicts to this JSONL file")
+    args = parser.parse_args(argv)
+
+    upgrade()
+    report = open(args.report, "w") if args.report else None
+    executor = None
+    if not args.hashed and args.workers > 1:
+        executor = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        importer = Importer(executor, args.workers, hashed=args.hashed, active=args.active, report=report)
+        elapsed = importer.run(read_rows(args.path), args.batch_size)
+    finally:
+        if executor:
+            executor.shutdown()
+        if report:
+            report.close()
+
+    print(f"{importer.inserted} inserted, {importer.conflicts} conflicts, {importer.invalid} invalid "
+          f"in {elapsed:.1f}s ({importer.inserted / elapsed if elapsed else 0:.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
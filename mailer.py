@@ -0,0 +1,354 @@
+#! /usr/bin/env python3
+# mailer.py
+
+import os
+import queue
+import smtplib
+import threading
+import time
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from metrics import span, timed
+
+
+class MailQueueFull(Exception):
+    pass
+
+
+# smtp settings, read from the environment
+@dataclass
+class SMTPSettings:
+    host: str = "mail.pythonhat.com"
+    port: int = 465
+    use_ssl: bool = True
+    starttls: bool = False
+    username: Optional[str] = "smtp_admin@pythonhat.com"
+    password_file: Optional[str] = "password.txt"
+    sender: str = "smtp_admin@pythonhat.com"
+    timeout: float = 10.0
+
+    @classmethod
+    def from_env(cls):
+        defaults = cls()
+        return cls(
+            host=os.environ.get("SMTP_HOST", defaults.host),
+            port=int(os.environ.get("SMTP_PORT", defaults.port)),
+            use_ssl=os.environ.get("SMTP_USE_SSL", "1") == "1",
+            starttls=os.environ.get("SMTP_STARTTLS", "0") == "1",
+            username=os.environ.get("SMTP_USER", defaults.username) or None,
+            password_file=os.environ.get("SMTP_PASSWORD_FILE", defaults.password_file) or None,
+            sender=os.environ.get("SMTP_SENDER", defaults.sender),
+            timeout=float(os.environ.get("SMTP_TIMEOUT", defaults.timeout)),
+        )
+
+    def load_password(self) -> Optional[str]:
+        if not self.password_file:
+            return None
+        with open(self.password_file) as f:
+            return f.read().strip()
+
+
+# errors the server reports for this message only, retrying won't help
+def is_permanent(ex: Exception) -> bool:
+    if isinstance(ex, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(ex, smtplib.SMTPResponseException) and ex.smtp_code >= 500
+
+
+class PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+# keeps a few authenticated smtp sessions around so each message
+# does not pay for a tcp + tls handshake and a login
+class SMTPConnectionPool:
+    def __init__(self, settings: SMTPSettings, size: int = 2,
+                 max_messages_per_connection: int = 100, max_idle: float = 30.0,
+                 retries: int = 3, backoff: float = 0.5):
+        self.settings = settings
+        self.size = size
+        self.max_messages_per_connection = max_messages_per_connection
+        self.max_idle = max_idle
+        self.retries = retries
+        self.backoff = backoff
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._password: Optional[str] = None
+        self._password_loaded = False
+
+    # read the password once up front, otherwise it is read on the first connect
+    def load_credentials(self):
+        self._password = self.settings.load_password()
+        self._password_loaded = True
+
+    @timed("smtp_connect")
+    def _connect(self) -> PooledConnection:
+        s = self.settings
+        if s.use_ssl:
+            smtp = smtplib.SMTP_SSL(s.host, s.port, timeout=s.timeout)
+        else:
+            smtp = smtplib.SMTP(s.host, s.port, timeout=s.timeout)
+            if s.starttls:
+                smtp.starttls()
+        if not self._password_loaded:
+            self._password = s.load_password()
+            self._password_loaded = True
+        if s.username and self._password is not None:
+            smtp.login(s.username, self._password)
+        return PooledConnection(smtp)
+
+    @staticmethod
+    def _discard(conn: PooledConnection):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            try:
+                conn.smtp.close()
+            except Exception:
+                pass
+
+    def acquire(self) -> PooledConnection:
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - conn.last_used < self.max_idle:
+                    return conn
+                # the server may have dropped an idle session, check before reuse
+                try:
+                    if conn.smtp.noop()[0] == 250:
+                        return conn
+                except Exception:
+                    pass
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: PooledConnection, broken: bool = False):
+        try:
+            if broken or conn.sent >= self.max_messages_per_connection:
+                self._discard(conn)
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    # send one message, reconnecting with backoff on transient failures
+    def send(self, msg: EmailMessage):
+        attempt = 0
+        while True:
+            conn = None
+            try:
+                conn = self.acquire()
+                with span("smtp_send"):
+                    conn.smtp.send_message(msg)
+                conn.sent += 1
+                self.release(conn)
+                return
+            except Exception as ex:
+                if conn is not None:
+                    permanent = is_permanent(ex)
+                    if permanent:
+                        try:
+                            conn.smtp.rset()
+                        except Exception:
+                            permanent = False
+                            self.release(conn, broken=True)
+                        else:
+                            self.release(conn)
+                    else:
+                        self.release(conn, broken=True)
+                    if permanent:
+                        raise
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+# bounded in-process queue drained by background threads,
+# so a request only pays for the enqueue
+class MailQueue:
+    def __init__(self, pool: SMTPConnectionPool, maxsize: int = 1000, workers: Optional[int] = None):
+        self.pool = pool
+        self.workers = workers or pool.size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self.sent = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"mail-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self.pool.close()
+
+    # on_sent runs on the worker thread once the message is accepted by the server
+    def submit(self, msg: EmailMessage, timeout: float = 0, on_sent: Optional[Callable[[], None]] = None):
+        try:
+            self._queue.put((msg, on_sent), block=timeout > 0, timeout=timeout or None)
+        except queue.Full:
+            raise MailQueueFull("mail queue is full")
+
+    def join(self):
+        self._queue.join()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                msg, on_sent = item
+                try:
+                    self.pool.send(msg)
+                    self.sent += 1
+                except Exception as ex:
+                    self.failed += 1
+                    print(f"Error sending email to {msg['To']}: {ex}")
+                    continue
+                if on_sent is not None:
+                    try:
+                        on_sent()
+                    except Exception as ex:
+                        print(f"Error after sending email to {msg['To']}: {ex}")
+            finally:
+                self._queue.task_done()
+
+
+# token bucket shared by all sessions of a bulk run
+class RateLimiter:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+@dataclass
+class BulkResult:
+    sent: int = 0
+    failures: List[Tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def failed(self) -> int:
+        return len(self.failures)
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+# streams messages over a fixed number of long-lived sessions; the
+# source iterable is consumed lazily through a bounded hand-off queue
+class BulkSender:
+    def __init__(self, settings: SMTPSettings, sessions: int = 4,
+                 max_messages_per_connection: int = 100, rate: Optional[float] = None,
+                 max_pending: int = 1000):
+        self.pool = SMTPConnectionPool(settings, size=sessions,
+                                       max_messages_per_connection=max_messages_per_connection)
+        self.sessions = sessions
+        self.limiter = RateLimiter(rate) if rate else None
+        self.max_pending = max_pending
+
+    def send(self, messages: Iterable[EmailMessage],
+             on_progress: Optional[Callable[[BulkResult], None]] = None,
+             progress_every: int = 1000) -> BulkResult:
+        result = BulkResult()
+        pending = queue.Queue(maxsize=self.max_pending)
+        lock = threading.Lock()
+        started = time.monotonic()
+
+        def worker():
+            while True:
+                msg = pending.get()
+                if msg is None:
+                    return
+                if self.limiter:
+                    self.limiter.wait()
+                try:
+                    self.pool.send(msg)
+                except Exception as ex:
+                    with lock:
+                        result.failures.append((msg['To'], str(ex)))
+                    continue
+                with lock:
+                    result.sent += 1
+                    if on_progress and result.sent % progress_every == 0:
+                        result.elapsed = time.monotonic() - started
+                        on_progress(result)
+
+        threads = [threading.Thread(target=worker, name=f"bulk-mail-{i}", daemon=True)
+                   for i in range(self.sessions)]
+        for t in threads:
+            t.start()
+        try:
+            for msg in messages:
+                pending.put(msg)
+        finally:
+            for _ in threads:
+                pending.put(None)
+            for t in threads:
+                t.join()
+            self.pool.close()
+        result.elapsed = time.monotonic() - started
+        return result
+
+
+mail_queue = MailQueue(
+    SMTPConnectionPool(
+        SMTPSettings.from_env(),
+        size=int(os.environ.get("SMTP_POOL_SIZE", 2)),
+        max_messages_per_connection=int(os.environ.get("SMTP_MAX_MESSAGES_PER_CONNECTION", 100)),
+    ),
+    maxsize=int(os.environ.get("MAIL_QUEUE_SIZE", 1000)),
+)
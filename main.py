@@ -1,44 +1,142 @@
 #! /usr/bin/env python3
  # main.py
 
-from typing import Union
-
-from fastapi import FastAPI, Request, Depends, Form, HTTPException, Response
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from connection import Base, engine, sess_db
-from sqlalchemy.orm import Session
-from fastapi.responses import RedirectResponse, Response
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import os
+import threading
+import csv
+import io
+import json
+from typing import Optional
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import FastAPI, Request, Depends, Form, HTTPException, Response, Query
+from connection import async_engine, async_write_engine, async_sess_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import RedirectResponse, Response, JSONResponse, StreamingResponse
 
 # Scurity
-from scurity import get_password_hash, create_access_token, verify_token, verify_password, COOKIE_NAME
+from scurity import get_password_hash_async, create_access_token, create_verification_token, verify_email_token, verify_password_async, get_admin_user, COOKIE_NAME
+from hashing import hash_pool, HashPoolBusy
 
 # Repository
-from repositoryuser import UserRepository, SendEmailVerify
-
-# Model
-from models import UserModel
-
-templates = Jinja2Templates(directory="templates")
-
-app = FastAPI()
+from repositoryuser import AsyncUserRepository, SendEmailVerify, stream_users, USER_LISTING_COLUMNS
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Mail
+from mailer import mail_queue, MailQueueFull
+from outbox import new_entry, mark_sent
 
-# db_engine
-Base.metadata.create_all(bind=engine)
+# Model
+from schema import Roles
+
+# Rate limiting
+from ratelimit import RateLimitMiddleware
+
+# Unverified account sweeper
+from sweeper import Sweeper, sweep_forever, SWEEPER_ENABLED
+
+# Templates and static files
+from rendering import page_cache, static_assets
+
+# Instrumentation
+from metrics import registry, TimingMiddleware, StartupTimer, CONTENT_TYPE, METRICS_ENABLED
+from usercache import user_cache
+from tokens import token_cache
+
+PAGES = ("index.html", "about.html", "signin.html", "signup.html")
+
+# serve.py migrates once before starting workers and sets SCHEMA_READY=1
+SCHEMA_READY = os.environ.get("SCHEMA_READY") == "1"
+STARTUP_REPORT = os.environ.get("STARTUP_REPORT", "1") == "1"
+
+startup = StartupTimer()
+startup.add("imports", time.perf_counter() - _import_started)
+registry.collector(startup.collect)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not SCHEMA_READY:
+        with startup.phase("schema"):
+            from migrations import upgrade
+            upgrade()
+    with startup.phase("credentials"):
+        try:
+            mail_queue.pool.load_credentials()
+        except OSError as ex:
+            print(f"SMTP password not loaded: {ex}")
+    with startup.phase("mail queue"):
+        mail_queue.start()
+    with startup.phase("hash pool"):
+        hash_pool.start()
+    with startup.phase("static"):
+        static_assets.load()
+    with startup.phase("pages"):
+        page_cache.warm(*PAGES)
+    if STARTUP_REPORT:
+        # SERVE_STARTED is set by serve.py, covers interpreter start and imports
+        launched = os.environ.get("SERVE_STARTED")
+        since = f", ready {time.time() - float(launched):.3f}s after launch" if launched else ""
+        print(f"startup pid {os.getpid()}: {startup.report()}{since}")
+    # safe in every worker, but one sweeping process (or the CLI on a timer) is enough
+    sweeper_stop = threading.Event()
+    sweeper_task = asyncio.create_task(sweep_forever(Sweeper(), sweeper_stop)) if SWEEPER_ENABLED else None
+    yield
+    if sweeper_task:
+        sweeper_stop.set()
+        await sweeper_task
+    hash_pool.shutdown()
+    mail_queue.stop()
+    await async_engine.dispose()
+    await async_write_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+
+# runs before routing, so throttled logins never touch the db or bcrypt
+app.add_middleware(RateLimitMiddleware)
+# outermost, so Server-Timing and latency cover the limiter too
+app.add_middleware(TimingMiddleware)
+
+@registry.collector
+def app_collector():
+    yield ("app_user_cache_events_total", "counter", "User cache lookups and evictions",
+           [({"event": name}, value) for name, value in user_cache.stats().items()])
+    token_stats = token_cache.stats()
+    yield ("app_token_cache_events_total", "counter", "Verified token cache lookups and evictions",
+           [({"event": name}, token_stats[name]) for name in ("hits", "misses", "evictions")])
+    yield ("app_token_cache_size", "gauge", "Tokens held in the verified token cache", [({}, token_stats["size"])])
+    yield ("app_mail_total", "counter", "Emails handled by the background mail queue",
+           [({"result": "sent"}, mail_queue.sent), ({"result": "failed"}, mail_queue.failed)])
+    yield ("app_mail_queue_depth", "gauge", "Emails waiting in the mail queue", [({}, mail_queue.depth)])
+    yield ("app_hash_pool_pending", "gauge", "Password hashes running or queued", [({}, hash_pool.pending)])
+    yield ("app_hash_pool_rejected_total", "counter", "Hash requests refused with 503", [({}, hash_pool.rejected)])
+
+@app.exception_handler(HashPoolBusy)
+async def hash_pool_busy(request: Request, exc: HashPoolBusy):
+    return JSONResponse({"detail": "Server busy, try again later"}, status_code=503, headers={"Retry-After": "1"})
+
+app.mount("/static", static_assets, name="static")
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404)
+    return Response(registry.render(), media_type=CONTENT_TYPE)
 
 @app.get("/")
 def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return page_cache.response(request, "index.html")
 
 @app.get("/about")
 def about(request: Request):
-    return templates.TemplateResponse("about.html", {"request": request})
+    return page_cache.response(request, "about.html")
 
 @app.get("/user/signin")
 def login(req: Request):
-    return templates.TemplateResponse("/signin.html", {"request": req})
+    return page_cache.response(req, "signin.html")
 
 # @app.post("/signinuser")
 # def signin_user(db: Session = Depends(sess_db), username: str = Form(...), password: str = Form(...)):
@@ -78,11 +176,11 @@ def login(req: Request):
 
 
 @app.post("/signinuser")
-def signin_user(response: Response, db: Session = Depends(sess_db), username: str = Form(...), password: str = Form(...)):
-    userRepository = UserRepository(db)
-    db_user = userRepository.get_user_by_username(username)
+async def signin_user(response: Response, db: AsyncSession = Depends(async_sess_db), username: str = Form(...), password: str = Form(...)):
+    userRepository = AsyncUserRepository(db)
+    db_user = await userRepository.get_user_by_username(username)
 
-    if not db_user or not verify_password(password, db_user.password):
+    if not db_user or not await verify_password_async(password, db_user.password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
     token = create_access_token(db_user)
@@ -93,53 +191,103 @@ def signin_user(response: Response, db: Session = Depends(sess_db), username: st
 
 @app.get("/user/signup")
 def signup(req: Request):
-    return templates.TemplateResponse("/signup.html", {"request": req})
+    return page_cache.response(req, "signup.html")
 
 @app.post("/signupuser")
-def signupuser(db:Session=Depends(sess_db), username: str = Form(),
+async def signupuser(db:AsyncSession=Depends(async_sess_db), username: str = Form(),
                                             email: str = Form(),
                                             password: str = Form()):
     print(username)
     print(email)
     print(password)
 
-    userRepository = UserRepository(db)
+    userRepository = AsyncUserRepository(db)
 
-    db_user = userRepository.get_user_by_username(username)
-    if db_user:
+    conflicts = await userRepository.find_conflicts(username, email)
+    if "username" in conflicts:
         return "username is not valid"
+    if conflicts:
+        raise HTTPException(status_code=400, detail="Credentials not valid")
 
-    signup = UserModel(email=email, username=username, password=get_password_hash(password))
-    success = userRepository.create_user(signup)
-    token = create_access_token(signup)
+    created = await userRepository.insert_user_with_email(
+        username, email, await get_password_hash_async(password),
+        lambda user: new_entry("verify", user.email, create_verification_token(user)))
 
-    print(token)
+    if created:
+        signup, outbox_email = created
 
-    SendEmailVerify.sendVerify(token)
+        # sent right away when we hold the lease; otherwise, or if the queue
+        # is full, outbox.py delivers it
+        if outbox_email.lease_owner:
+            try:
+                SendEmailVerify.queueVerify(outbox_email.payload, email, timeout=0,
+                                            on_sent=partial(mark_sent, [outbox_email.id]))
+            except MailQueueFull:
+                print(f"Mail queue full, verification email {outbox_email.id} left to the outbox sender")
 
-    if success:
         return "User created successfully."
     else:
         raise HTTPException(status_code=400, detail="Credentials not valid")
 
 @app.get("/user/verify/{token}")
-def verify_user(token, db:Session=Depends(sess_db)):
-    userRepository = UserRepository(db)
-    payload = verify_token(token)
-    username = payload.get("username")
-    db_user = userRepository.get_user_by_username(username)
-    # db_user = userRepository.get_user_by_username(username)
+async def verify_user(token: str, db: AsyncSession = Depends(async_sess_db)):
+    payload = verify_email_token(token)
+    if payload is None:
+        raise HTTPException(status_code=400, detail="Verification link is invalid or has expired")
+
+    userRepository = AsyncUserRepository(db)
+    activated = await userRepository.activate(payload["username"], payload["email"])
 
-    if not username:
-        raise HTTPException(status_code=401, detail="Credentials not correct")
+    if activated is None:
+        raise HTTPException(status_code=400, detail="Verification link is no longer valid")
 
-    if db_user.is_active == True:
+    # a second click, or a replayed link, changes nothing
+    if not activated:
         return "User verified successfully."
 
-    db_user.is_active = True
-    db.commit()
     # response = RedirectResponse(url="/user/signin", status_code=status.HTTP_302_FOUND)
     response = RedirectResponse(url="/user/signin")
 
     return response
 
+
+
+# Admin
+
+EXPORT_FIELDS = [column.key for column in USER_LISTING_COLUMNS]
+
+def listed_user(row):
+    user = row._asdict()
+    user["role"] = row.role.value if row.role is not None else None
+    user["created_at"] = row.created_at.isoformat() if row.created_at is not None else None
+    return user
+
+@app.get("/admin/users")
+async def admin_list_users(admin=Depends(get_admin_user), db: AsyncSession = Depends(async_sess_db),
+                           limit: int = Query(50, ge=1, le=500), after: Optional[int] = None,
+                           is_active: Optional[bool] = None, role: Optional[Roles] = None):
+    rows = await AsyncUserRepository(db).list_users(limit, after, is_active, role)
+    # pass next back as ?after= for the following page
+    return {"users": [listed_user(row) for row in rows], "next": rows[-1].id if len(rows) == limit else None}
+
+@app.get("/admin/users/export")
+async def admin_export_users(admin=Depends(get_admin_user), format: str = Query("ndjson", pattern="^(csv|ndjson)$"),
+                             is_active: Optional[bool] = None, role: Optional[Roles] = None):
+    async def ndjson():
+        async for rows in stream_users(async_engine, is_active, role):
+            yield "".join(json.dumps(listed_user(row)) + "\n" for row in rows)
+
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_FIELDS)
+        writer.writeheader()
+        async for rows in stream_users(async_engine, is_active, role):
+            writer.writerows(listed_user(row) for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(csv_rows() if format == "csv" else ndjson(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="users.{format}"'})
@@ -0,0 +1,283 @@
+#! /usr/bin/env python3
+# metrics.py
+#
+# Timing spans scoped to the current request, Prometheus histograms and
+# counters, and a middleware that reports each request's spans in a
+# Server-Timing header. No app imports, every other module may use it.
+
+import bisect
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# off by default: span names reveal which code paths ran, e.g. whether a
+# sign in reached bcrypt_verify, so only turn it on where clients are trusted
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        names = self.labelnames + ("le",)
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(names, labels + (_number(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+# a collector returns (name, kind, help, [(labels dict, value), ...]) tuples
+# for values that live elsewhere, e.g. cache hit counters
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        metric = Histogram(name, help, labelnames, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Collector) -> Collector:
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collect in self.collectors:
+            try:
+                families = list(collect())
+            except Exception as ex:
+                print(f"metrics collector {getattr(collect, '__name__', collect)} failed: {ex}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+SPAN_SECONDS = registry.histogram("app_span_seconds", "Time spent in instrumented operations", ("span",))
+DB_QUERIES = registry.counter("app_db_queries_total", "SQL statements executed", ("engine",))
+HTTP_SECONDS = registry.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+
+# span name -> [seconds, count] for the request being handled, None outside a request
+_timings: ContextVar[Optional[Dict[str, list]]] = ContextVar("request_timings", default=None)
+
+
+def record(name: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    SPAN_SECONDS.observe(seconds, name)
+    timings = _timings.get()
+    if timings is not None:
+        entry = timings.get(name)
+        if entry is None:
+            timings[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+@contextmanager
+def span(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+# decorator form of span, for plain and async functions
+def timed(name: str):
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - started)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+# query time and count for every statement run on a (sync) engine
+def instrument_engine(sync_engine, name: str = "default"):
+    if not METRICS_ENABLED:
+        return sync_engine
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        record("db", time.perf_counter() - conn.info["query_started"].pop())
+        DB_QUERIES.inc(name)
+
+    def error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            record("db", time.perf_counter() - started.pop())
+
+    event.listen(sync_engine, "before_cursor_execute", before)
+    event.listen(sync_engine, "after_cursor_execute", after)
+    event.listen(sync_engine, "handle_error", error)
+    return sync_engine
+
+
+# named phases of process startup, reported once the app is ready
+class StartupTimer:
+    def __init__(self):
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def add(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    def report(self) -> str:
+        return ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases)
+
+    def collect(self):
+        yield ("app_startup_seconds", "gauge", "Time spent in each startup phase",
+               [({"phase": name}, seconds) for name, seconds in self.phases])
+
+
+def server_timing(timings: Dict[str, list], total: float) -> str:
+    parts = [f"{name};dur={seconds * 1000:.2f};desc=\"{count}x\"" for name, (seconds, count) in timings.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+# outermost middleware: opens the per-request span table, adds the
+# Server-Timing header and records latency per route template
+class TimingMiddleware:
+    def __init__(self, app, enabled: bool = METRICS_ENABLED, server_timing: bool = SERVER_TIMING):
+        self.app = app
+        self.enabled = enabled
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = server_timing(timings, time.perf_counter() - started).encode("latin-1")
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header)])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            # the route template keeps label cardinality bounded, unmatched paths share one label
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - started, scope["method"], route, str(status))
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+# migrations.py
+#
+# Small built-in schema migrations. A fresh database gets the current
+# models through create_all and is stamped with the latest version; an
+# existing one runs the steps it has not seen yet, in order.
+#   python migrations.py upgrade
+#   python migrations.py current
+
+import argparse
+import sys
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text, func
+
+from connection import Base, write_engine
+import models
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+
+def _index(name):
+    return next(index for index in models.UserModel.__table__.indexes if index.name == name)
+
+
+# the password column held a unique index on bcrypt hashes, which are unique
+# anyway and never queried; the index on the primary key duplicates it
+def drop_redundant_indexes(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_password"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_id"))
+
+
+def add_created_at(conn):
+    if "created_at" in {c["name"] for c in inspect(conn).get_columns("users")}:
+        return
+    column_type = DateTime().compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE users ADD COLUMN created_at {column_type}"))
+    # existing accounts start ageing from the migration
+    conn.execute(text("UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
+
+
+def add_lookup_indexes(conn):
+    _index("ix_users_unverified_created_at").create(conn, checkfirst=True)
+    _index("ix_users_role_is_active_id").create(conn, checkfirst=True)
+
+
+def add_email_outbox(conn):
+    models.EmailOutboxModel.__table__.create(conn, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, "drop unique index on users.password and duplicate index on users.id", drop_redundant_indexes),
+    (2, "add users.created_at", add_created_at),
+    (3, "partial index on unverified users, role/is_active index", add_lookup_indexes),
+    (4, "add email_outbox", add_email_outbox),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def _stamp(conn, version, description):
+    conn.execute(schema_version.insert().values(version=version, description=description,
+                                                applied_at=func.current_timestamp()))
+
+
+def upgrade(engine=write_engine, verbose: bool = False) -> int:
+    with engine.begin() as conn:
+        fresh = not inspect(conn).has_table("users")
+        Base.metadata.create_all(bind=conn)
+        schema_version.create(conn, checkfirst=True)
+        version = current_version(conn)
+        if fresh and version == 0:
+            _stamp(conn, HEAD, "created from models")
+            return HEAD
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            # another process may have got here first
+            if current_version(conn) >= number:
+                continue
+            if verbose:
+                print(f"applying {number}: {description}")
+            step(conn)
+            _stamp(conn, number, description)
+        version = number
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("command", choices=["upgrade", "current"], nargs="?", default="upgrade")
+    args = parser.parse_args(argv)
+
+    if args.command == "current":
+        with write_engine.connect() as conn:
+            print(f"schema version {current_version(conn)} (latest {HEAD})")
+    else:
+        print(f"schema version {upgrade(verbose=True)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 #! /usr/bin/env python3
 # models.py
 
-from sqlalchemy import Column, String, Integer, Boolean, Enum
+from sqlalchemy import Column, String, Integer, Boolean, Enum, DateTime, Index, Text, func, text
 from schema import Roles
 from connection import Base
 
@@ -9,12 +9,45 @@ from connection import Base
 class UserModel(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     email = Column(String, unique=True, index=True)
     username = Column(String, unique=True, index=True)
-    password = Column(String, unique=True, index=True)
+    password = Column(String)
     is_active = Column(Boolean, default=False)
-    role = Column(Enum(Roles), default="user")
+    role = Column(Enum(Roles), default=Roles.user)
+    created_at = Column(DateTime, default=func.current_timestamp(), server_default=func.current_timestamp())
+
+    __table_args__ = (
+        # unverified accounts only, oldest first: resend and expiry scans
+        Index("ix_users_unverified_created_at", "created_at", "id",
+              sqlite_where=text("is_active = 0"), postgresql_where=text("is_active = false")),
+        # role/is_active filters with keyset pagination on id
+        Index("ix_users_role_is_active_id", "role", "is_active", "id"),
+    )
+
+
+# emails written in the same transaction as the change that caused them,
+# delivered by outbox.py; a lease marks a row as being sent by lease_owner
+class EmailOutboxModel(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    recipient = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | sent | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    available_at = Column(DateTime, nullable=False)
+    lease_owner = Column(String)
+    lease_expires = Column(DateTime)
+    created_at = Column(DateTime, default=func.current_timestamp(), server_default=func.current_timestamp())
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        # what the sender scans for: due rows that are still pending
+        Index("ix_email_outbox_status_available_at", "status", "available_at"),
+    )
 
 
 # class UserModel(Base):
@@ -0,0 +1,250 @@
+#! /usr/bin/env python3
+# outbox.py
+#
+# Durable email outbox. Rows are written in the same transaction as the
+# user they belong to; senders claim due rows under a lease, send them
+# over pooled SMTP connections and mark them sent. A row whose lease runs
+# out (sender or web process died mid-send) is picked up again; after
+# OUTBOX_MAX_ATTEMPTS it is dead-lettered. Run as many senders as needed.
+#   python outbox.py send --sessions 4
+#   python outbox.py send --once
+#   python outbox.py stats
+#   python outbox.py requeue-dead
+#   python outbox.py purge --days 7
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert, or_, select, update
+
+from connection import write_engine
+from models import EmailOutboxModel as Outbox
+
+# the web process sends right away under its own lease, the sender
+# process only sees the row if that fails
+OUTBOX_INLINE = os.environ.get("OUTBOX_INLINE", "1") == "1"
+OUTBOX_LEASE_SECONDS = float(os.environ.get("OUTBOX_LEASE_SECONDS", 120))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BACKOFF = float(os.environ.get("OUTBOX_BACKOFF", 30))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@dataclass
+class OutboxEntry:
+    kind: str
+    recipient: str
+    payload: str
+    id: Optional[int] = None
+    attempts: int = 0
+    lease_owner: Optional[str] = None
+
+
+def new_entry(kind: str, recipient: str, payload: str, inline: bool = OUTBOX_INLINE) -> OutboxEntry:
+    if inline:
+        return OutboxEntry(kind, recipient, payload, attempts=1, lease_owner=WORKER_ID)
+    return OutboxEntry(kind, recipient, payload)
+
+
+def insert_entry(entry: OutboxEntry, lease_seconds: float = OUTBOX_LEASE_SECONDS):
+    now = utcnow()
+    return (insert(Outbox)
+            .values(kind=entry.kind, recipient=entry.recipient, payload=entry.payload, status="pending",
+                    attempts=entry.attempts, available_at=now, lease_owner=entry.lease_owner,
+                    lease_expires=now + timedelta(seconds=lease_seconds) if entry.lease_owner else None)
+            .returning(Outbox.id))
+
+
+# due rows are leased with a single UPDATE ... WHERE id IN (SELECT ...);
+# on PostgreSQL the inner select takes FOR UPDATE SKIP LOCKED so
+# concurrent senders never wait on each other, SQLite serializes writers
+# and ignores the clause
+def claim_batch(engine=write_engine, owner: str = WORKER_ID, batch_size: int = OUTBOX_BATCH_SIZE,
+                lease_seconds: float = OUTBOX_LEASE_SECONDS) -> List[OutboxEntry]:
+    now = utcnow()
+    claimable = (Outbox.status == "pending", Outbox.available_at <= now,
+                 or_(Outbox.lease_expires.is_(None), Outbox.lease_expires < now))
+    due = (select(Outbox.id).where(*claimable).order_by(Outbox.id).limit(batch_size)
+           .with_for_update(skip_locked=True))
+    stmt = (update(Outbox)
+            .where(Outbox.id.in_(due), *claimable)
+            .values(lease_owner=owner, lease_expires=now + timedelta(seconds=lease_seconds),
+                    attempts=Outbox.attempts + 1)
+            .returning(Outbox.id, Outbox.kind, Outbox.recipient, Outbox.payload, Outbox.attempts))
+    with engine.begin() as conn:
+        rows = conn.execute(stmt).all()
+    return sorted((OutboxEntry(row.kind, row.recipient, row.payload, id=row.id, attempts=row.attempts,
+                               lease_owner=owner) for row in rows), key=lambda entry: entry.id)
+
+
+# only rows still leased to owner: a send that outlived its lease must
+# not overwrite the claim of the sender that picked the row up since
+def mark_sent(ids: Iterable[int], engine=write_engine, owner: str = WORKER_ID):
+    ids = list(ids)
+    if not ids:
+        return
+    with engine.begin() as conn:
+        conn.execute(update(Outbox).where(Outbox.id.in_(ids), Outbox.lease_owner == owner)
+                     .values(status="sent", sent_at=utcnow(), lease_owner=None, lease_expires=None))
+
+
+# back off exponentially, dead-letter permanent failures and rows out of attempts
+def mark_failed(entry: OutboxEntry, error: Exception, permanent: bool = False, engine=write_engine,
+                max_attempts: int = OUTBOX_MAX_ATTEMPTS, backoff: float = OUTBOX_BACKOFF) -> bool:
+    dead = permanent or entry.attempts >= max_attempts
+    retry_at = utcnow() + timedelta(seconds=backoff * 2 ** max(0, entry.attempts - 1))
+    with engine.begin() as conn:
+        conn.execute(update(Outbox)
+                     .where(Outbox.id == entry.id, Outbox.lease_owner == entry.lease_owner)
+                     .values(status="dead" if dead else "pending", last_error=str(error)[:1000],
+                             available_at=retry_at, lease_owner=None, lease_expires=None))
+    return dead
+
+
+def build_message(entry: OutboxEntry):
+    if entry.kind == "verify":
+        from repositoryuser import SendEmailVerify
+        return SendEmailVerify.buildVerify(entry.payload, entry.recipient)
+    raise ValueError(f"unknown outbox message kind {entry.kind!r}")
+
+
+class OutboxSender:
+    def __init__(self, pool, engine=write_engine, owner: str = WORKER_ID, batch_size: int = OUTBOX_BATCH_SIZE,
+                 lease_seconds: float = OUTBOX_LEASE_SECONDS, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff: float = OUTBOX_BACKOFF):
+        self.pool = pool
+        self.engine = engine
+        self.owner = owner
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.sent = self.retried = self.dead = 0
+        self._executor = ThreadPoolExecutor(pool.size, thread_name_prefix="outbox")
+
+    def _send(self, entry: OutboxEntry) -> Optional[Exception]:
+        try:
+            self.pool.send(build_message(entry))
+        except Exception as ex:
+            return ex
+        return None
+
+    # claim one batch and send it, returns the number of rows claimed
+    def send_batch(self) -> int:
+        from mailer import is_permanent
+
+        entries = claim_batch(self.engine, self.owner, self.batch_size, self.lease_seconds)
+        if not entries:
+            return 0
+        errors = list(self._executor.map(self._send, entries))
+        mark_sent((entry.id for entry, error in zip(entries, errors) if error is None), self.engine, self.owner)
+        for entry, error in zip(entries, errors):
+            if error is None:
+                self.sent += 1
+                continue
+            print(f"Error sending {entry.kind} email {entry.id} to {entry.recipient}: {error}")
+            permanent = isinstance(error, ValueError) or is_permanent(error)
+            if mark_failed(entry, error, permanent, self.engine, self.max_attempts, self.backoff):
+                self.dead += 1
+            else:
+                self.retried += 1
+        return len(entries)
+
+    def run(self, poll_interval: float = 1.0, once: bool = False, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            claimed = self.send_batch()
+            if claimed >= self.batch_size:
+                continue
+            if once:
+                return
+            stop.wait(poll_interval)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+def stats(engine=write_engine):
+    with engine.connect() as conn:
+        counts = dict(conn.execute(select(Outbox.status, func.count()).group_by(Outbox.status)).all())
+        leased = conn.execute(select(func.count()).where(Outbox.status == "pending",
+                                                         Outbox.lease_expires >= utcnow())).scalar()
+    return {"pending": counts.get("pending", 0), "leased": leased, "sent": counts.get("sent", 0),
+            "dead": counts.get("dead", 0)}
+
+
+def requeue_dead(engine=write_engine) -> int:
+    with engine.begin() as conn:
+        return conn.execute(update(Outbox).where(Outbox.status == "dead")
+                            .values(status="pending", attempts=0, available_at=utcnow())).rowcount
+
+
+def purge_sent(days: float, engine=write_engine) -> int:
+    with engine.begin() as conn:
+        return conn.execute(delete(Outbox).where(Outbox.status == "sent",
+                                                 Outbox.sent_at < utcnow() - timedelta(days=days))).rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deliver and manage queued emails")
+    sub = parser.add_subparsers(dest="command", required=True)
+    send = sub.add_parser("send", help="deliver due emails until stopped")
+    send.add_argument("--once", action="store_true", help="exit when nothing is due")
+    send.add_argument("--sessions", type=int, default=int(os.environ.get("SMTP_POOL_SIZE", 4)),
+                      help="SMTP connections, also the number of concurrent sends")
+    send.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    send.add_argument("--lease", type=float, default=OUTBOX_LEASE_SECONDS, help="seconds a claimed batch is held")
+    send.add_argument("--max-attempts", type=int, default=OUTBOX_MAX_ATTEMPTS)
+    send.add_argument("--poll", type=float, default=1.0, help="seconds between polls when idle")
+    sub.add_parser("stats", help="row counts by status")
+    sub.add_parser("requeue-dead", help="give dead-lettered emails another round of attempts")
+    purge = sub.add_parser("purge", help="delete sent emails")
+    purge.add_argument("--days", type=float, default=7, help="keep emails sent within this many days")
+    args = parser.parse_args(argv)
+
+    from migrations import upgrade
+    upgrade()
+
+    if args.command == "stats":
+        print(" ".join(f"{name}={count}" for name, count in stats().items()))
+    elif args.command == "requeue-dead":
+        print(f"{requeue_dead()} requeued")
+    elif args.command == "purge":
+        print(f"{purge_sent(args.days)} purged")
+    else:
+        from mailer import SMTPConnectionPool, SMTPSettings
+
+        # the outbox retries on its own schedule, keep the pool's retries short
+        pool = SMTPConnectionPool(SMTPSettings.from_env(), size=args.sessions, retries=1)
+        sender = OutboxSender(pool, batch_size=args.batch_size, lease_seconds=args.lease,
+                              max_attempts=args.max_attempts)
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        started = time.monotonic()
+        try:
+            sender.run(args.poll, once=args.once, stop=stop)
+        finally:
+            sender.close()
+        print(f"{sender.sent} sent, {sender.retried} to retry, {sender.dead} dead-lettered "
+              f"in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
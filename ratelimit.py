@@ -0,0 +1,242 @@
+#! /usr/bin/env python3
+# ratelimit.py
+#
+# Token bucket limiter for the auth endpoints, as ASGI middleware so a
+# rejected request never reaches a database query or bcrypt.
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from metrics import registry
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")  # memory | redis
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# "<requests>/<seconds>"
+RATE_LIMIT_IP = os.environ.get("RATE_LIMIT_IP", "30/60")
+RATE_LIMIT_USERNAME = os.environ.get("RATE_LIMIT_USERNAME", "10/60")
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get("RATE_LIMIT_TRUST_FORWARDED", "0") == "1"
+RATE_LIMIT_PATHS = ("/signinuser", "/signupuser")
+MAX_FORM_BYTES = 64 * 1024
+
+RATE_LIMITED = registry.counter("ratelimit_rejected_total", "Requests rejected by the rate limiter", ("rule",))
+
+
+def parse_rate(rate: str) -> Tuple[float, float]:
+    requests, _, seconds = rate.partition("/")
+    return float(requests), float(seconds or 1)
+
+
+# keeps its rule, so pruning judges every bucket by its own rate
+class Bucket:
+    __slots__ = ("tokens", "stamp", "capacity", "per_second")
+
+    def __init__(self, tokens: float, stamp: float, capacity: float, per_second: float):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.capacity = capacity
+        self.per_second = per_second
+
+    def refilled(self, now: float) -> float:
+        return min(self.capacity, self.tokens + (now - self.stamp) * self.per_second)
+
+
+class MemoryStore:
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Bucket] = {}
+        self._lock = threading.Lock()
+
+    # returns (allowed, seconds until a token is available)
+    def take(self, key: str, capacity: float, per_second: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                bucket = self._buckets[key] = Bucket(capacity, now, capacity, per_second)
+            else:
+                bucket.capacity, bucket.per_second = capacity, per_second
+                bucket.tokens = bucket.refilled(now)
+                bucket.stamp = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return True, 0.0
+            return False, (1 - bucket.tokens) / per_second
+
+    # buckets that have refilled are the same as no bucket at all
+    def _prune(self, now: float):
+        full = [key for key, b in self._buckets.items() if b.refilled(now) >= b.capacity]
+        for key in full:
+            del self._buckets[key]
+        # still too many live buckets: drop the oldest half
+        if len(self._buckets) >= self.max_keys:
+            for key in list(self._buckets)[: len(self._buckets) // 2]:
+                del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# same token bucket kept in redis so every worker shares the counters
+class RedisStore:
+    SCRIPT = """
+local b = redis.call('HMGET', KEYS[1], 't', 's')
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens, stamp = tonumber(b[1]) or capacity, tonumber(b[2]) or now
+tokens = math.min(capacity, tokens + (now - stamp) * rate)
+local allowed = 0
+if tokens >= 1 then tokens = tokens - 1; allowed = 1 end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 's', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring((1 - tokens) / rate)}
+"""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str = RATE_LIMIT_REDIS_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package (pip install redis)")
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key: str, capacity: float, per_second: float) -> Tuple[bool, float]:
+        allowed, retry_after = self._script(keys=[self.prefix + key], args=[capacity, per_second, time.time()])
+        return bool(allowed), max(0.0, float(retry_after))
+
+
+class Rule:
+    def __init__(self, name: str, rate: str):
+        self.name = name
+        self.capacity, seconds = parse_rate(rate)
+        self.per_second = self.capacity / seconds
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, store=None, paths=RATE_LIMIT_PATHS, ip_rate: Optional[str] = RATE_LIMIT_IP,
+                 username_rate: Optional[str] = RATE_LIMIT_USERNAME, trust_forwarded: bool = RATE_LIMIT_TRUST_FORWARDED,
+                 enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.store = store if store is not None else make_store()
+        self.paths = set(paths)
+        self.ip_rule = Rule("ip", ip_rate) if ip_rate else None
+        self.username_rule = Rule("username", username_rate) if username_rate else None
+        self.trust_forwarded = trust_forwarded
+        self.enabled = enabled
+        self.rejected = 0
+
+    def client_ip(self, scope) -> str:
+        if self.trust_forwarded:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def check(self, rule: Rule, value: str) -> Optional[float]:
+        allowed, retry_after = self.store.take(f"{rule.name}:{value}", rule.capacity, rule.per_second)
+        return None if allowed else retry_after
+
+    async def reject(self, scope, receive, send, rule: Rule, retry_after: float):
+        self.rejected += 1
+        RATE_LIMITED.inc(rule.name)
+        response = JSONResponse({"detail": "Too many requests"}, status_code=429,
+                                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))})
+        await response(scope, receive, send)
+
+    async def too_large(self, scope, receive, send):
+        self.rejected += 1
+        RATE_LIMITED.inc("body_size")
+        response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if (not self.enabled or scope["type"] != "http" or scope["method"] != "POST"
+                or scope["path"] not in self.paths):
+            return await self.app(scope, receive, send)
+
+        if self.ip_rule:
+            retry_after = self.check(self.ip_rule, self.client_ip(scope))
+            if retry_after is not None:
+                return await self.reject(scope, receive, send, self.ip_rule, retry_after)
+
+        if not self.username_rule:
+            return await self.app(scope, receive, send)
+
+        # read the form once to find the username, then replay it downstream
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+            # never hand an unread remainder downstream: that would
+            # skip the username rule and still reach bcrypt
+            if len(body) > MAX_FORM_BYTES:
+                return await self.too_large(scope, receive, send)
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        # bodies the limiter cannot read a username from share one bucket
+        username = await self.username(scope, body) or ""
+        retry_after = self.check(self.username_rule, username.strip().lower())
+        if retry_after is not None:
+            return await self.reject(scope, replay, send, self.username_rule, retry_after)
+        await self.app(scope, replay, send)
+
+    async def username(self, scope, body: bytes) -> Optional[str]:
+        content_type = dict(scope.get("headers", ())).get(b"content-type", b"").decode("latin-1").lower()
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return parse_qs(body.decode("latin-1")).get("username", [None])[0]
+        if content_type.startswith("multipart/form-data"):
+            sent = False
+
+            async def once():
+                nonlocal sent
+                if sent:
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            try:
+                form = await Request(scope, once).form()
+                value = form.get("username")
+                await form.close()
+                return value if isinstance(value, str) else None
+            except Exception:
+                return None
+        if content_type.startswith("application/json"):
+            try:
+                value = json.loads(body).get("username")
+                return value if isinstance(value, str) else None
+            except (ValueError, AttributeError):
+                return None
+        return None
+
+
+def make_store(kind: str = RATE_LIMIT_BACKEND):
+    if kind == "redis":
+        return RedisStore.from_url()
+    return MemoryStore()
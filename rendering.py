@@ -0,0 +1,229 @@
+#! /usr/bin/env python3
+# rendering.py
+#
+# Template environment with an on-disk bytecode cache, a cache of fully
+# rendered context-free pages, and a static file app that serves
+# fingerprinted, precompressed assets.
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from starlette.requests import Request
+from starlette.responses import Response
+
+from metrics import span
+
+TEMPLATE_DIR = "templates"
+STATIC_DIR = "static"
+STATIC_PREFIX = "/static"
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR", ".jinja_cache")
+PAGE_CACHE = os.environ.get("PAGE_CACHE", "1") == "1"
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_SIZE = 256
+ENCODING_SUFFIX = {"gzip": "gz", "br": "br"}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:20] + '"'
+
+
+# each content coding is a different representation and needs its own
+# strong validator (RFC 9110 8.8.3)
+def _coded_etag(etag: str, encoding: Optional[str]) -> str:
+    return etag if encoding is None else etag[:-1] + "-" + ENCODING_SUFFIX[encoding] + '"'
+
+
+# the tag from If-None-Match that still matches one of etags, None if none
+# does; "*" matches the first
+def _not_modified(request_headers, etags) -> Optional[str]:
+    header = request_headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etags[0]
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag in etags:
+            return tag
+    return None
+
+
+# codings the client accepts with q > 0; "*" covers any coding not listed
+def _accepted(request_headers) -> Dict[str, float]:
+    accepted = {}
+    for item in request_headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def _accepts(accepted: Dict[str, float], encoding: str) -> bool:
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+@dataclass
+class Encoded:
+    body: bytes
+    etag: str
+    media_type: str
+    gzip: Optional[bytes] = None
+    br: Optional[bytes] = None
+
+    @classmethod
+    def build(cls, body: bytes, media_type: str):
+        encoded = cls(body, _etag(body), media_type)
+        if len(body) >= MIN_COMPRESS_SIZE and media_type.startswith(COMPRESSIBLE):
+            encoded.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                encoded.br = brotli.compress(body, quality=11)
+        return encoded
+
+    # pick the smallest representation the client accepts
+    def negotiate(self, request_headers):
+        accepted = _accepted(request_headers)
+        if self.br is not None and _accepts(accepted, "br"):
+            return self.br, "br"
+        if self.gzip is not None and _accepts(accepted, "gzip"):
+            return self.gzip, "gzip"
+        return self.body, None
+
+    def etags(self):
+        return [_coded_etag(self.etag, encoding) for encoding, body in
+                ((None, self.body), ("gzip", self.gzip), ("br", self.br)) if body is not None]
+
+    def respond(self, request_headers, cache_control: str, head: bool = False) -> Response:
+        headers = {"Cache-Control": cache_control}
+        if self.gzip is not None:
+            headers["Vary"] = "Accept-Encoding"
+        body, encoding = self.negotiate(request_headers)
+        etag = _coded_etag(self.etag, encoding)
+        # a cache may revalidate any representation it holds
+        matched = _not_modified(request_headers, [etag] + [tag for tag in self.etags() if tag != etag])
+        if matched:
+            headers["ETag"] = matched
+            return Response(status_code=304, headers=headers)
+        headers["ETag"] = etag
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        response = Response(b"" if head else body, media_type=self.media_type, headers=headers)
+        if head:
+            response.headers["Content-Length"] = str(len(body))
+        return response
+
+
+# fingerprinted, precompressed static files held in memory
+class StaticAssets:
+    def __init__(self, directory: str = STATIC_DIR, prefix: str = STATIC_PREFIX):
+        self.directory = directory
+        self.prefix = prefix
+        self.assets: Dict[str, Encoded] = {}
+        self.urls: Dict[str, str] = {}
+        self.loaded = False
+
+    def load(self):
+        assets, urls = {}, {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                full = os.path.join(root, filename)
+                path = os.path.relpath(full, self.directory).replace(os.sep, "/")
+                with open(full, "rb") as f:
+                    body = f.read()
+                media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                encoded = Encoded.build(body, media_type)
+                stem, ext = os.path.splitext(path)
+                fingerprinted = f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+                assets[path] = assets[fingerprinted] = encoded
+                urls[path] = f"{self.prefix}/{fingerprinted}"
+        self.assets, self.urls, self.loaded = assets, urls, True
+
+    def url(self, path: str) -> str:
+        path = path.lstrip("/")
+        if not self.loaded:
+            self.load()
+        return self.urls.get(path, f"{self.prefix}/{path}")
+
+    async def __call__(self, scope, receive, send):
+        request = Request(scope, receive)
+        if request.method not in ("GET", "HEAD"):
+            response = Response(status_code=405, headers={"Allow": "GET, HEAD"})
+        else:
+            if not self.loaded:
+                self.load()
+            path, root_path = scope["path"], scope.get("root_path", "")
+            if root_path and path.startswith(root_path):
+                path = path[len(root_path):]
+            path = path.lstrip("/")
+            encoded = self.assets.get(path)
+            if encoded is None:
+                response = Response("Not Found", status_code=404, media_type="text/plain")
+            else:
+                # the fingerprint changes with the content, so those URLs never go stale
+                immutable = path not in self.urls
+                cache_control = "public, max-age=31536000, immutable" if immutable else "public, max-age=300"
+                response = encoded.respond(request.headers, cache_control, head=request.method == "HEAD")
+        await response(scope, receive, send)
+
+
+# pages that render the same for every request, built once
+class PageCache:
+    def __init__(self, env: Environment, enabled: bool = PAGE_CACHE):
+        self.env = env
+        self.enabled = enabled
+        self.pages: Dict[str, Encoded] = {}
+
+    def get(self, name: str) -> Encoded:
+        page = self.pages.get(name) if self.enabled else None
+        if page is None:
+            with span("template"):
+                body = self.env.get_template(name).render().encode()
+            page = Encoded.build(body, "text/html; charset=utf-8")
+            if self.enabled:
+                self.pages[name] = page
+        return page
+
+    def warm(self, *names: str):
+        for name in names:
+            self.get(name)
+
+    def clear(self):
+        self.pages.clear()
+
+    def response(self, request: Request, name: str) -> Response:
+        return self.get(name).respond(request.headers, "public, max-age=0, must-revalidate",
+                                      head=request.method == "HEAD")
+
+
+def make_environment(directory: str = TEMPLATE_DIR, cache_dir: Optional[str] = TEMPLATE_CACHE_DIR) -> Environment:
+    bytecode_cache = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    return Environment(loader=FileSystemLoader(directory), autoescape=True,
+                       bytecode_cache=bytecode_cache, auto_reload=not PAGE_CACHE)
+
+
+static_assets = StaticAssets()
+env = make_environment()
+env.globals["static_url"] = static_assets.url
+page_cache = PageCache(env)
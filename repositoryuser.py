@@ -45,29 +45,104 @@
 
 from sqlalchemy.orm import Session
 from models import UserModel
-from typing import Dict,Any
+from schema import Roles
+from typing import Dict,Any,Optional,Set,Callable,Tuple
 from sqlalchemy.orm import Session
+from sqlalchemy import select, update, insert, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-import smtplib
+import os
 from email.message import EmailMessage
+from mailer import mail_queue
+from usercache import user_cache, UserRecord
+from outbox import OutboxEntry, insert_entry
+
+APP_BASE_URL = os.environ.get("APP_BASE_URL", "http://localhost:8000")
+
+USER_RECORD_COLUMNS = (UserModel.id, UserModel.username, UserModel.email,
+                       UserModel.password, UserModel.is_active, UserModel.role)
+
+# what admins get to see of a user, never the password hash
+USER_LISTING_COLUMNS = (UserModel.id, UserModel.username, UserModel.email,
+                        UserModel.is_active, UserModel.role, UserModel.created_at)
+
+# ordered by id for keyset pagination; with a role filter this walks
+# ix_users_role_is_active_id
+def select_user_listing(is_active: Optional[bool] = None, role: Optional[Roles] = None):
+    query = select(*USER_LISTING_COLUMNS).order_by(UserModel.id)
+    if role is not None:
+        query = query.where(UserModel.role == role)
+    if is_active is not None:
+        query = query.where(UserModel.is_active == is_active)
+    return query
+
+def select_user_record(*where):
+    return select(*USER_RECORD_COLUMNS).where(*where).limit(1)
+
+def to_record(row):
+    return UserRecord(*row) if row is not None else None
+
+# INSERT that skips rows hitting a unique constraint instead of failing
+def insert_ignore(dialect_name: str):
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects import sqlite
+        return sqlite.insert(UserModel).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects import postgresql
+        return postgresql.insert(UserModel).on_conflict_do_nothing()
+    if dialect_name in ("mysql", "mariadb"):
+        return insert(UserModel).prefix_with("IGNORE")
+    return insert(UserModel)
+
+# one query over both unique indexes, tells which of the two is taken
+def select_conflicts(username: str, email: str):
+    return (select(UserModel.username, UserModel.email)
+            .where(or_(UserModel.username == username, UserModel.email == email))
+            .limit(2))
+
+def conflict_fields(rows, username: str, email: str) -> Set[str]:
+    fields = set()
+    for row in rows:
+        if row.username == username:
+            fields.add("username")
+        if row.email == email:
+            fields.add("email")
+    return fields
 
 class UserRepository:
     def __init__(self,sess:Session):
         self.sess: Session=sess
 
     def create_user(self,signup:UserModel) -> bool:
+        username, email = signup.username, signup.email
         try:
             self.sess.add(signup)
             self.sess.commit()
         except:
             return False
+        finally:
+            user_cache.invalidate(username, email)
         return True
 
     def get_user(self):
         return  self.sess.query(UserModel).all()
 
     def get_user_by_username(self,username:str):
-        return self.sess.query(UserModel).filter(UserModel.username==username).first()
+        record = user_cache.get_by_username(username)
+        if record is None:
+            row = self.sess.execute(select_user_record(UserModel.username==username)).first()
+            record = user_cache.put(to_record(row))
+        return record
+
+    # stream users still waiting for verification, batch_size rows at a time
+    def iter_inactive_users(self, batch_size: int = 500):
+        query = (self.sess.query(UserModel.username, UserModel.email, UserModel.role, UserModel.is_active)
+                 .filter(UserModel.is_active == False)
+                 .order_by(UserModel.created_at, UserModel.id)
+                 .execution_options(yield_per=batch_size))
+        for row in query:
+            yield row
 
     # def update_user(self,id:int,details:Dict[str,Any]) -> bool:
     #     try:
@@ -84,32 +159,103 @@ class UserRepository:
     #         return  False
     #     return  True
 
-class SendEmailVerify:
+# same operations on an AsyncSession, for handlers running on the event loop
+class AsyncUserRepository:
+    def __init__(self, sess: AsyncSession):
+        self.sess: AsyncSession = sess
+
+    # username/email already taken, checked before spending time on bcrypt
+    async def find_conflicts(self, username: str, email: str) -> Set[str]:
+        result = await self.sess.execute(select_conflicts(username, email))
+        return conflict_fields(result, username, email)
+
+    def _insert_user_stmt(self, username: str, email: str, password: str):
+        return (insert_ignore(self.sess.get_bind().dialect.name)
+                .values(username=username, email=email, password=password, is_active=False, role=Roles.user)
+                .returning(*USER_RECORD_COLUMNS))
+
+    # the user and its outbox email commit together, so the email survives
+    # a crash right after signup; None on conflict
+    async def insert_user_with_email(self, username: str, email: str, password: str,
+                                     build_email: Callable[[UserRecord], OutboxEntry]) -> Optional[Tuple[UserRecord, OutboxEntry]]:
+        try:
+            record = to_record((await self.sess.execute(self._insert_user_stmt(username, email, password))).first())
+            if record is None:
+                await self.sess.rollback()
+                return None
+            entry = build_email(record)
+            entry.id = (await self.sess.execute(insert_entry(entry))).scalar_one()
+            await self.sess.commit()
+        except SQLAlchemyError:
+            await self.sess.rollback()
+            return None
+        finally:
+            user_cache.invalidate(username, email)
+        return record, entry
 
-    def sendVerify(token):
-        email_address = "smtp_admin@pythonhat.com" # fastapi-login
-        # email_password = "h3ll0_br0ther"
+    # one page of users with id > after
+    async def list_users(self, limit: int, after: Optional[int] = None, is_active: Optional[bool] = None,
+                         role: Optional[Roles] = None):
+        query = select_user_listing(is_active, role).limit(limit)
+        if after is not None:
+            query = query.where(UserModel.id > after)
+        return (await self.sess.execute(query)).all()
 
-        # read password from file
-        with open('password.txt') as f:
-            email_password = f.read().strip()
+    async def get_user_by_username(self, username: str):
+        record = user_cache.get_by_username(username)
+        if record is None:
+            row = (await self.sess.execute(select_user_record(UserModel.username == username))).first()
+            record = user_cache.put(to_record(row))
+        return record
 
-        # create email
+    # one conditional UPDATE, safe against double clicks: True when this
+    # call activated the account, False when it already was active, None
+    # when no account has this username and email (deleted or re-registered)
+    async def activate(self, username: str, email: str) -> Optional[bool]:
+        result = await self.sess.execute(
+            update(UserModel)
+            .where(UserModel.username == username, UserModel.email == email, UserModel.is_active == False)
+            .values(is_active=True))
+        await self.sess.commit()
+        if result.rowcount:
+            user_cache.invalidate(username, email)
+            return True
+        # only repeated or stale links get here
+        row = (await self.sess.execute(
+            select(UserModel.id).where(UserModel.username == username, UserModel.email == email))).first()
+        return None if row is None else False
+
+# every matching user, batch_size rows at a time over a streaming cursor;
+# opens its own connection so it can outlive the request's session
+async def stream_users(engine, is_active: Optional[bool] = None, role: Optional[Roles] = None,
+                       batch_size: int = 1000):
+    async with engine.connect() as conn:
+        result = await conn.stream(select_user_listing(is_active, role).execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield rows
+
+class SendEmailVerify:
+
+    # create email
+    @staticmethod
+    def buildVerify(token, recipient) -> EmailMessage:
         msg = EmailMessage()
         msg['Subject'] = "Email subject"
-        msg['From'] = email_address
-        msg['To'] = "ezalahmad@gmail.com" # type Email
+        msg['From'] = mail_queue.pool.settings.sender
+        msg['To'] = recipient
         msg.set_content(
                 f"""\
                         verify account
-        http://localhost:8000/user/verify/{token}
+        {APP_BASE_URL}/user/verify/{token}
         """,
 
         )
-        # send email
-        with smtplib.SMTP_SSL('mail.pythonhat.com', 465) as smtp:
-            smtp.login(email_address, email_password)
-            smtp.send_message(msg)
+        return msg
+
+    # hand the email to the background workers, raises MailQueueFull
+    @staticmethod
+    def queueVerify(token, recipient, timeout: float = 2.0, on_sent=None):
+        mail_queue.submit(SendEmailVerify.buildVerify(token, recipient), timeout=timeout, on_sent=on_sent)
 
 
 # class SendEmailVerify:
@@ -1,19 +1,33 @@
 #! /usr/bin/env python3
 # scurity.py
 
-from passlib.context import CryptContext
+import os
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import Depends, Request
-from jose import JWTError, jwt
+from fastapi import Depends, HTTPException, Request
+from jose import JWTError
 # pip install python-jose | https://github.com/mpdavis/python-jose
+from datetime import datetime, timedelta, timezone
 
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from connection import async_sess_db
 from models import UserModel
+from repositoryuser import select_user_record, to_record
+from schema import Roles
+from hashing import hash_pool, hash_password, check_password
+from tokens import jwt_backend, token_cache
+from metrics import span
 
-JWT_SECRET = "secret"
+# set JWT_SECRET in production, the default only suits development
+JWT_SECRET = os.environ.get("JWT_SECRET", "secret")
 JWT_ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 3000
+VERIFY_TOKEN_EXPIRE_HOURS = float(os.environ.get("VERIFY_TOKEN_EXPIRE_HOURS", 72))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# purpose claim, so an emailed verification link can never be used to
+# sign in and a sign in token can never verify an email address
+ACCESS_PURPOSE = "access"
+VERIFY_PURPOSE = "verify"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/signin")
 COOKIE_NAME = "Authorization"
@@ -26,16 +40,45 @@ def create_access_token(user):
                 "email": user.email,
                 "role": user.role.value,
                 "active": user.is_active,
+                "purpose": ACCESS_PURPOSE,
+                "exp": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
                 }
-        return jwt.encode(payload, key=JWT_SECRET, algorithm=JWT_ALGORITHM)
+        with span("jwt_encode"):
+            return jwt_backend.encode(payload, key=JWT_SECRET, algorithm=JWT_ALGORITHM)
     except Exception as ex:
         print(str(ex))
         raise ex
 
-# create verify Token
+# email verification token, bound to the username and the address it was sent to
+def create_verification_token(user):
+    payload = {
+            "username": user.username,
+            "email": user.email,
+            "purpose": VERIFY_PURPOSE,
+            "exp": datetime.now(timezone.utc) + timedelta(hours=VERIFY_TOKEN_EXPIRE_HOURS),
+            }
+    with span("jwt_encode"):
+        return jwt_backend.encode(payload, key=JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+# payload of a valid, unexpired verification token, None for anything else
+def verify_email_token(token):
+    try:
+        payload = verify_token(token)
+    except JWTError:
+        return None
+    if payload.get("purpose") != VERIFY_PURPOSE or not payload.get("username") or not payload.get("email"):
+        return None
+    return payload
+
+# create verify Token, a token seen before skips the signature check until it expires
 def verify_token(token):
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
-        payload = jwt.decode(token, key=JWT_SECRET)
+        with span("jwt_decode"):
+            payload = jwt_backend.decode(token, key=JWT_SECRET, algorithm=JWT_ALGORITHM)
+        token_cache.put(token, payload)
         return payload
     except Exception as ex:
         print(str(ex))
@@ -43,11 +86,21 @@ def verify_token(token):
 
 # password hash
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return hash_password(password)
 
 # password verify
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return check_password(plain_password, hashed_password)
+
+# password hash on the bcrypt pool, raises HashPoolBusy when saturated
+async def get_password_hash_async(password):
+    with span("bcrypt_hash"):
+        return await hash_pool.hash(password)
+
+# password verify on the bcrypt pool, raises HashPoolBusy when saturated
+async def verify_password_async(plain_password, hashed_password):
+    with span("bcrypt_verify"):
+        return await hash_pool.verify(plain_password, hashed_password)
 
 def get_current_user_from_token(token:str=Depends(oauth2_scheme)):
     user = verify_token(token)
@@ -58,3 +111,29 @@ def get_current_user_from_cookie(request: Request) -> UserModel:
     if token:
         user = verify_token(token)
         return user
+
+# bearer header first, then the cookie set at sign in
+def token_from_request(request: Request):
+    header = request.headers.get("authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token
+    return request.cookies.get(COOKIE_NAME)
+
+# the role is read from the database, not the token or the user cache,
+# so a demoted admin loses access on their next request
+async def get_admin_user(request: Request, db: AsyncSession = Depends(async_sess_db)):
+    token = token_from_request(request)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        payload = verify_token(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    # tokens issued before the purpose claim existed were access tokens
+    if payload.get("purpose", ACCESS_PURPOSE) != ACCESS_PURPOSE:
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    user = to_record((await db.execute(select_user_record(UserModel.username == payload.get("username")))).first())
+    if user is None or not user.is_active or user.role != Roles.admin:
+        raise HTTPException(status_code=403, detail="Admin role required")
+    return user
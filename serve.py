@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+# serve.py
+#
+# Production entry point. Migrates the schema once in this process, then
+# starts uvicorn workers (uvloop and httptools when installed) that skip
+# schema setup. Workers default to one per core, WEB_CONCURRENCY overrides.
+#   python -m serve
+#   python -m serve --workers 4 --port 8080
+
+import argparse
+import os
+import sys
+import time
+from importlib.util import find_spec
+
+
+def main(argv=None):
+    started = time.time()
+    parser = argparse.ArgumentParser(description="Run the app under uvicorn")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "info"))
+    parser.add_argument("--no-access-log", action="store_true", help="skip per-request log lines")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("SERVE_STARTED", repr(started))
+    # every worker starts its own bcrypt pool, share the cores between them
+    os.environ.setdefault("HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+    if not os.environ.get("JWT_SECRET"):
+        print("warning: JWT_SECRET is not set, tokens are signed with the development key")
+
+    loop = "uvloop" if find_spec("uvloop") else "asyncio"
+    http = "httptools" if find_spec("httptools") else "h11"
+
+    schema_started = time.perf_counter()
+    from migrations import upgrade
+    from connection import engine, write_engine
+    version = upgrade()
+    engine.dispose()
+    write_engine.dispose()
+    os.environ["SCHEMA_READY"] = "1"
+
+    print(f"serve: {args.workers} worker(s), loop={loop}, http={http}, "
+          f"schema version {version} in {time.perf_counter() - schema_started:.3f}s")
+
+    import uvicorn
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, loop=loop, http=http,
+                log_level=args.log_level, access_log=not args.no_access_log, proxy_headers=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,84 @@
 #! /usr/bin/env python3
  # smtp_email.py
+ #
+ # python smtp_email.py test --to someone@example.com
+ # python smtp_email.py resend-pending --sessions 4 --rate 50
 
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-# Email credentials and server configuration
-SMTP_SERVER = 'mail.pythonhat.com'
-SMTP_PORT = 465
-EMAIL = 'smtp_admin@pythonhat.com'  # Replace with your email
-PASSWORD = 'h3llo'        # Replace with your password
-
-# Email content
-recipient = 'ezalahmad@gmail.com'  # Replace with recipient's email
-subject = 'Test Email for FastAPI app'
-body = 'This is a test email sent with SSL/TLS.'
-
-# Create the email
-message = MIMEMultipart()
-message['From'] = EMAIL
-message['To'] = recipient
-message['Subject'] = subject
-message.attach(MIMEText(body, 'plain'))
-
-try:
-    # Connect to the SMTP server using SSL
-    with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-        server.login(EMAIL, PASSWORD)  # Log in to the server
-        server.sendmail(EMAIL, recipient, message.as_string())  # Send email
+import argparse
+import sys
+from email.message import EmailMessage
+
+from mailer import SMTPSettings, SMTPConnectionPool, BulkSender
+
+
+def send_test(settings, recipient):
+    # Create the email
+    message = EmailMessage()
+    message['From'] = settings.sender
+    message['To'] = recipient
+    message['Subject'] = 'Test Email for FastAPI app'
+    message.set_content('This is a test email sent with SSL/TLS.')
+
+    pool = SMTPConnectionPool(settings, size=1, retries=0)
+    try:
+        pool.send(message)
         print("Email sent successfully!")
-except Exception as e:
-    print(f"Failed to send email: {e}")
+    except Exception as e:
+        print(f"Failed to send email: {e}")
+        return 1
+    finally:
+        pool.close()
+    return 0
+
+
+def resend_pending(settings, args):
+    from connection import SessionFactory
+    from repositoryuser import UserRepository, SendEmailVerify
+    from scurity import create_verification_token
+    from migrations import upgrade
+
+    upgrade()
+
+    def progress(result):
+        print(f"{result.sent} sent, {result.failed} failed, {result.throughput:.1f} msg/s")
+
+    db = SessionFactory()
+    try:
+        messages = (SendEmailVerify.buildVerify(create_verification_token(user), user.email)
+                    for user in UserRepository(db).iter_inactive_users(args.batch_size))
+        sender = BulkSender(settings, sessions=args.sessions,
+                            max_messages_per_connection=args.max_per_connection,
+                            rate=args.rate)
+        result = sender.send(messages, on_progress=progress)
+    finally:
+        db.close()
+
+    for recipient, error in result.failures:
+        print(f"Failed to send email to {recipient}: {error}")
+    print(f"{result.sent} sent, {result.failed} failed in {result.elapsed:.1f}s "
+          f"({result.throughput:.1f} msg/s)")
+    return 1 if result.failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send emails for the FastAPI app")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    test = commands.add_parser("test", help="send a single test email")
+    test.add_argument("--to", required=True, help="recipient address")
+
+    resend = commands.add_parser("resend-pending", help="resend verification emails to inactive users")
+    resend.add_argument("--sessions", type=int, default=4, help="number of SMTP sessions kept open")
+    resend.add_argument("--max-per-connection", type=int, default=100, help="messages sent before reconnecting")
+    resend.add_argument("--rate", type=float, default=None, help="maximum messages per second")
+    resend.add_argument("--batch-size", type=int, default=500, help="rows fetched from the database at a time")
+
+    args = parser.parse_args(argv)
+    settings = SMTPSettings.from_env()
+    if args.command == "test":
+        return send_test(settings, args.to)
+    return resend_pending(settings, args)
+
 
+if __name__ == "__main__":
+    sys.exit(main())
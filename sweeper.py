@@ -0,0 +1,194 @@
+#! /usr/bin/env python3
+# sweeper.py
+#
+# Deletes accounts that were never verified. Works through them oldest
+# first in small keyset batches over the partial index on unverified
+# users, one short write transaction per batch, throttled to a rows per
+# second budget so the single SQLite writer is never held for long.
+# Runs from the app lifespan (SWEEPER_ENABLED=1) or from the command line.
+#   python sweeper.py --max-age-hours 72 --dry-run
+#   python sweeper.py --archive purged.jsonl
+#   python sweeper.py --loop --interval 600
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from sqlalchemy import String, delete, func, select, tuple_, type_coerce
+
+from connection import engine, write_engine
+from metrics import registry
+from models import UserModel
+from usercache import user_cache
+
+SWEEPER_ENABLED = os.environ.get("SWEEPER_ENABLED", "0") == "1"
+SWEEP_MAX_AGE_HOURS = float(os.environ.get("SWEEP_MAX_AGE_HOURS", 72))
+SWEEP_BATCH_SIZE = int(os.environ.get("SWEEP_BATCH_SIZE", 200))
+SWEEP_ROWS_PER_SECOND = float(os.environ.get("SWEEP_ROWS_PER_SECOND", 1000))
+SWEEP_INTERVAL = float(os.environ.get("SWEEP_INTERVAL", 600))
+
+ROWS_PURGED = registry.counter("sweeper_rows_purged_total", "Unverified accounts deleted by the sweeper")
+LOCK_WAIT = registry.histogram("sweeper_lock_wait_seconds", "Time a sweeper batch waited for the write lock")
+BATCH_SECONDS = registry.histogram("sweeper_batch_seconds", "Time a sweeper batch held its write transaction")
+
+# created_at goes back into the keyset exactly as stored: SQLite keeps
+# CURRENT_TIMESTAMP as text without fractions, a round trip through
+# DateTime would add them and skip rows from the same second
+CREATED_AT = type_coerce(UserModel.created_at, String)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Sweeper:
+    def __init__(self, max_age_hours: float = SWEEP_MAX_AGE_HOURS, batch_size: int = SWEEP_BATCH_SIZE,
+                 rows_per_second: float = SWEEP_ROWS_PER_SECOND, reader=engine, writer=write_engine,
+                 archive: Optional[Callable[[List], None]] = None):
+        self.max_age = timedelta(hours=max_age_hours)
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        self.reader = reader
+        self.writer = writer
+        self.archive = archive
+        self.purged = 0
+        self.batches = 0
+        self.lock_wait = 0.0
+
+    def _stale(self, cutoff: datetime):
+        return (UserModel.is_active == False, UserModel.created_at < cutoff)
+
+    def count(self) -> int:
+        with self.reader.connect() as conn:
+            return conn.execute(select(func.count()).select_from(UserModel)
+                                .where(*self._stale(utcnow() - self.max_age))).scalar()
+
+    def _next_batch(self, cutoff: datetime, after):
+        # columns in keyset order, so the last row is the next `after`
+        query = (select(CREATED_AT, UserModel.id).where(*self._stale(cutoff))
+                 .order_by(UserModel.created_at, UserModel.id).limit(self.batch_size))
+        if after is not None:
+            query = query.where(tuple_(CREATED_AT, UserModel.id) > after)
+        with self.reader.connect() as conn:
+            return conn.execute(query).all()
+
+    # one short write transaction; is_active is checked again so a user
+    # who verified since the select is kept
+    def _delete(self, ids) -> List:
+        started = time.perf_counter()
+        with self.writer.connect() as conn:
+            if conn.dialect.name == "sqlite":
+                # take the write lock up front so the wait can be measured
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+            waited = time.perf_counter() - started
+            rows = conn.execute(delete(UserModel)
+                                .where(UserModel.id.in_(ids), UserModel.is_active == False)
+                                .returning(UserModel.id, UserModel.username, UserModel.email,
+                                           UserModel.created_at)).all()
+            conn.commit()
+        held = time.perf_counter() - started - waited
+        self.lock_wait += waited
+        LOCK_WAIT.observe(waited)
+        BATCH_SECONDS.observe(held)
+        return rows
+
+    def sweep(self, stop: Optional[threading.Event] = None) -> int:
+        cutoff = utcnow() - self.max_age
+        after = None
+        purged = 0
+        while stop is None or not stop.is_set():
+            started = time.perf_counter()
+            batch = self._next_batch(cutoff, after)
+            if not batch:
+                break
+            after = tuple(batch[-1])
+            rows = self._delete([row.id for row in batch])
+            for row in rows:
+                user_cache.invalidate(row.username, row.email)
+            if rows and self.archive is not None:
+                self.archive(rows)
+            purged += len(rows)
+            self.purged += len(rows)
+            self.batches += 1
+            ROWS_PURGED.inc(amount=len(rows))
+            if len(batch) < self.batch_size:
+                break
+            # stay within the rows per second budget
+            pause = len(batch) / self.rows_per_second - (time.perf_counter() - started)
+            if pause > 0:
+                if stop is not None:
+                    stop.wait(pause)
+                else:
+                    time.sleep(pause)
+        return purged
+
+
+# lifespan task: sweep every interval seconds until stop is set
+async def sweep_forever(sweeper: Sweeper, stop: threading.Event, interval: float = SWEEP_INTERVAL):
+    while not stop.is_set():
+        try:
+            purged = await asyncio.to_thread(sweeper.sweep, stop)
+            if purged:
+                print(f"sweeper: {purged} unverified accounts removed")
+        except Exception as ex:
+            print(f"sweeper failed: {ex}")
+        await asyncio.to_thread(stop.wait, interval)
+
+
+def jsonl_archive(f):
+    def write(rows):
+        for row in rows:
+            f.write(json.dumps({"id": row.id, "username": row.username, "email": row.email,
+                                "created_at": str(row.created_at)}) + "\n")
+        f.flush()
+    return write
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove accounts that were never verified")
+    parser.add_argument("--max-age-hours", type=float, default=SWEEP_MAX_AGE_HOURS)
+    parser.add_argument("--batch-size", type=int, default=SWEEP_BATCH_SIZE)
+    parser.add_argument("--rows-per-second", type=float, default=SWEEP_ROWS_PER_SECOND)
+    parser.add_argument("--archive", help="append removed accounts to this JSONL file")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be removed")
+    parser.add_argument("--loop", action="store_true", help="keep sweeping every --interval seconds")
+    parser.add_argument("--interval", type=float, default=SWEEP_INTERVAL)
+    args = parser.parse_args(argv)
+
+    from migrations import upgrade
+    upgrade()
+
+    archive = open(args.archive, "a") if args.archive else None
+    sweeper = Sweeper(args.max_age_hours, args.batch_size, args.rows_per_second,
+                      archive=jsonl_archive(archive) if archive else None)
+    if args.dry_run:
+        print(f"{sweeper.count()} unverified accounts older than {args.max_age_hours:g}h")
+        return 0
+
+    stop = threading.Event()
+    try:
+        while True:
+            started = time.monotonic()
+            purged = sweeper.sweep(stop)
+            elapsed = time.monotonic() - started
+            print(f"{purged} removed in {sweeper.batches} batches, {elapsed:.1f}s "
+                  f"(lock wait {sweeper.lock_wait:.3f}s total)")
+            if not args.loop:
+                break
+            stop.wait(args.interval)
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        if archive:
+            archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+# tests/conftest.py
+#
+# every test run gets its own throwaway SQLite database; set before any
+# app module creates its engines
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("SMTP_PASSWORD_FILE", "")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as c:
+        yield c
@@ -0,0 +1,29 @@
+# tests/test_admin.py
+
+from sqlalchemy import delete, update
+
+from connection import SessionFactory, write_engine
+from hashing import hash_password
+from models import UserModel
+from repositoryuser import UserRepository
+from schema import Roles
+from scurity import create_access_token
+
+
+def test_demoted_admin_loses_access(client):
+    with write_engine.begin() as conn:
+        conn.execute(delete(UserModel).where(UserModel.username == "boss"))
+        conn.execute(UserModel.__table__.insert(), {"username": "boss", "email": "boss@example.com",
+                                                    "password": hash_password("pw"), "is_active": True,
+                                                    "role": Roles.admin})
+    with SessionFactory() as db:
+        # also warms the user cache with the admin role
+        admin = UserRepository(db).get_user_by_username("boss")
+    headers = {"Authorization": "Bearer " + create_access_token(admin)}
+
+    assert client.get("/admin/users", headers=headers).status_code == 200
+
+    # demoted straight in SQL, the cached record still says admin
+    with write_engine.begin() as conn:
+        conn.execute(update(UserModel).where(UserModel.username == "boss").values(role=Roles.user))
+    assert client.get("/admin/users", headers=headers).status_code == 403
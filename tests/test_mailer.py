@@ -0,0 +1,65 @@
+# tests/test_mailer.py
+
+import time
+from email.message import EmailMessage
+
+import pytest
+
+from fakesmtp import FakeSMTPServer
+from mailer import MailQueue, SMTPConnectionPool, SMTPSettings
+
+
+@pytest.fixture
+def server():
+    server = FakeSMTPServer().start()
+    yield server
+    server.stop()
+
+
+def message(recipient):
+    msg = EmailMessage()
+    msg["Subject"] = "test"
+    msg["From"] = "app@example.com"
+    msg["To"] = recipient
+    msg.set_content("hello")
+    return msg
+
+
+def mail_queue(server):
+    settings = SMTPSettings(host=server.host, port=server.port, use_ssl=False, username=None,
+                            password_file=None, timeout=5)
+    queue = MailQueue(SMTPConnectionPool(settings, size=1, backoff=0.01))
+    queue.start()
+    return queue
+
+
+def test_messages_share_one_connection(server):
+    queue = mail_queue(server)
+    sent = []
+    try:
+        for i in range(5):
+            queue.submit(message(f"user{i}@example.com"), on_sent=lambda i=i: sent.append(i))
+        queue.join()
+    finally:
+        queue.stop()
+
+    assert [recipients for _, recipients, _ in server.messages] == [[f"user{i}@example.com"] for i in range(5)]
+    assert sent == list(range(5))
+    assert server.connections == 1
+
+
+def test_dropped_connection_reconnects(server):
+    queue = mail_queue(server)
+    try:
+        queue.submit(message("before@example.com"))
+        queue.join()
+        server.drop_connections()
+        time.sleep(0.1)
+        queue.submit(message("after@example.com"))
+        queue.join()
+    finally:
+        queue.stop()
+
+    assert [recipients for _, recipients, _ in server.messages] == [["before@example.com"], ["after@example.com"]]
+    assert (queue.sent, queue.failed) == (2, 0)
+    assert server.connections == 2
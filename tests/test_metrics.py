@@ -0,0 +1,8 @@
+# tests/test_metrics.py
+
+
+def test_no_server_timing_header_by_default(client):
+    response = client.post("/signinuser", data={"username": "nobody", "password": "x"})
+    assert response.status_code == 401
+    assert "server-timing" not in response.headers
+    assert "http_request_duration_seconds" in client.get("/metrics").text
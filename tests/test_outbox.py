@@ -0,0 +1,106 @@
+# tests/test_outbox.py
+
+import pytest
+from sqlalchemy import delete, select
+
+from connection import write_engine
+from fakesmtp import FakeSMTPServer
+from mailer import SMTPConnectionPool, SMTPSettings
+from migrations import upgrade
+from models import EmailOutboxModel as Outbox
+from outbox import (OutboxEntry, OutboxSender, claim_batch, insert_entry, mark_failed, mark_sent,
+                    requeue_dead, utcnow)
+
+
+@pytest.fixture(autouse=True)
+def empty_outbox():
+    upgrade()
+    with write_engine.begin() as conn:
+        conn.execute(delete(Outbox))
+    yield
+
+
+def queued(owner=None, lease_seconds=120, attempts=0, recipient="a@example.com"):
+    entry = OutboxEntry("verify", recipient, "token", attempts=attempts, lease_owner=owner)
+    with write_engine.begin() as conn:
+        entry.id = conn.execute(insert_entry(entry, lease_seconds)).scalar_one()
+    return entry
+
+
+def row(entry_id):
+    with write_engine.connect() as conn:
+        return conn.execute(select(Outbox).where(Outbox.id == entry_id)).one()
+
+
+def test_rows_leased_to_another_owner_are_not_claimed():
+    leased = queued(owner="web", attempts=1)
+    free = queued()
+    claimed = claim_batch(owner="sender")
+    assert [entry.id for entry in claimed] == [free.id]
+    assert row(leased.id).lease_owner == "web"
+
+
+def test_expired_lease_is_reclaimed_with_another_attempt():
+    stale = queued(owner="web", lease_seconds=-1, attempts=1)
+    claimed = claim_batch(owner="sender")
+    assert [(entry.id, entry.attempts) for entry in claimed] == [(stale.id, 2)]
+    assert row(stale.id).lease_owner == "sender"
+
+
+def test_mark_failed_backs_off_then_dead_letters():
+    entry = queued(owner="sender", attempts=1)
+    assert mark_failed(entry, RuntimeError("down"), backoff=60, max_attempts=2) is False
+    failed = row(entry.id)
+    assert (failed.status, failed.lease_owner, failed.last_error) == ("pending", None, "down")
+    assert failed.available_at > utcnow()
+    assert claim_batch(owner="sender") == []
+
+    last = queued(owner="sender", attempts=2)
+    assert mark_failed(last, RuntimeError("down"), backoff=60, max_attempts=2) is True
+    assert row(last.id).status == "dead"
+
+
+def test_mark_failed_and_mark_sent_leave_a_moved_lease_alone():
+    entry = queued(owner="web", lease_seconds=-1, attempts=1)
+    claim_batch(owner="sender")
+
+    assert mark_failed(entry, RuntimeError("late"), max_attempts=1) is True
+    mark_sent([entry.id], owner="web")
+    moved = row(entry.id)
+    assert (moved.status, moved.lease_owner, moved.last_error) == ("pending", "sender", None)
+
+    mark_sent([entry.id], owner="sender")
+    assert row(entry.id).status == "sent"
+
+
+def test_requeue_dead():
+    entry = queued(owner="sender", attempts=1)
+    mark_failed(entry, RuntimeError("bounced"), permanent=True)
+    assert row(entry.id).status == "dead"
+
+    assert requeue_dead() == 1
+    requeued = row(entry.id)
+    assert (requeued.status, requeued.attempts) == ("pending", 0)
+    assert [e.id for e in claim_batch(owner="sender")] == [entry.id]
+
+
+def test_sender_delivers_through_a_local_smtp_server():
+    server = FakeSMTPServer().start()
+    settings = SMTPSettings(host=server.host, port=server.port, use_ssl=False, username=None,
+                            password_file=None, timeout=5)
+    sender = OutboxSender(SMTPConnectionPool(settings, size=1), owner="sender", backoff=0)
+    try:
+        good = queued(recipient="good@example.com")
+        unknown = queued()
+        with write_engine.begin() as conn:
+            conn.execute(Outbox.__table__.update().where(Outbox.id == unknown.id).values(kind="nope"))
+        assert sender.send_batch() == 2
+    finally:
+        sender.close()
+        server.stop()
+
+    assert [recipients for _, recipients, _ in server.messages] == [["good@example.com"]]
+    assert row(good.id).status == "sent"
+    # an unknown kind can never be built, it is dead-lettered at once
+    assert row(unknown.id).status == "dead"
+    assert (sender.sent, sender.dead) == (1, 1)
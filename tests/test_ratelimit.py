@@ -0,0 +1,134 @@
+# tests/test_ratelimit.py
+
+import asyncio
+import json
+
+import pytest
+
+import ratelimit
+from ratelimit import MemoryStore, RateLimitMiddleware
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+# downstream app that records the body it was handed
+class Downstream:
+    def __init__(self):
+        self.bodies = []
+
+    async def __call__(self, scope, receive, send):
+        body, more = b"", True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        self.bodies.append(body)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(middleware, chunks, content_type=b"application/x-www-form-urlencoded", ip="10.0.0.1"):
+    scope = {"type": "http", "method": "POST", "path": "/signinuser", "client": (ip, 5000),
+             "headers": [(b"content-type", content_type)]}
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    start = sent[0]
+    return start["status"], dict(start["headers"])
+
+
+def limiter(ip_rate=None, username_rate="2/60"):
+    downstream = Downstream()
+    return RateLimitMiddleware(downstream, store=MemoryStore(), ip_rate=ip_rate,
+                               username_rate=username_rate, enabled=True), downstream
+
+
+def test_username_bucket_refills_and_sets_retry_after(clock):
+    middleware, _ = limiter()
+    form = [b"username=victim&password=x"]
+    assert [call(middleware, form)[0] for _ in range(3)] == [200, 200, 429]
+
+    status, headers = call(middleware, form)
+    assert status == 429
+    assert headers[b"retry-after"] == b"30"
+
+    clock.now += 30
+    assert call(middleware, form)[0] == 200
+    assert call(middleware, form)[0] == 429
+
+
+def test_ip_rule_runs_before_the_body_is_read(clock):
+    middleware, downstream = limiter(ip_rate="1/60", username_rate=None)
+    assert call(middleware, [b"username=a"])[0] == 200
+    assert call(middleware, [b"username=b"])[0] == 429
+    assert call(middleware, [b"username=c"], ip="10.0.0.2")[0] == 200
+    assert len(downstream.bodies) == 2
+
+
+@pytest.mark.parametrize("content_type, body", [
+    (b"application/x-www-form-urlencoded", b"username=Victim&password=x"),
+    (b"application/json", json.dumps({"username": "victim", "password": "x"}).encode()),
+    (b"multipart/form-data; boundary=XyZ",
+     b"--XyZ\r\nContent-Disposition: form-data; name=\"username\"\r\n\r\nvictim\r\n"
+     b"--XyZ\r\nContent-Disposition: form-data; name=\"password\"\r\n\r\nx\r\n--XyZ--\r\n"),
+])
+def test_username_is_read_from_every_form_encoding(clock, content_type, body):
+    middleware, downstream = limiter(username_rate="1/60")
+    assert call(middleware, [body], content_type)[0] == 200
+    # same account in another encoding shares the bucket
+    assert call(middleware, [b"username=victim&password=y"])[0] == 429
+    assert downstream.bodies == [body]
+
+
+def test_body_is_replayed_downstream_whole(clock):
+    middleware, downstream = limiter()
+    chunks = [b"username=victim", b"&password=", b"secret"]
+    assert call(middleware, chunks)[0] == 200
+    assert downstream.bodies == [b"".join(chunks)]
+
+
+def test_padded_body_cannot_skip_the_username_rule(clock):
+    middleware, downstream = limiter()
+    padded = [b"username=victim&password=x"] + [b"&p=" + b"x" * 30000] * 4
+    assert [call(middleware, padded)[0] for _ in range(4)] == [413, 413, 413, 413]
+    assert downstream.bodies == []
+
+
+def test_bodies_without_a_username_share_one_bucket(clock):
+    middleware, downstream = limiter()
+    statuses = [call(middleware, [b"password=x"], b"text/plain")[0] for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+def test_prune_judges_each_bucket_by_its_own_rule(clock):
+    store = MemoryStore(max_keys=3)
+    # slow rule: one token per 100s; fast rule: ten per second
+    store.take("username:slow", 1, 0.01)
+    store.take("ip:fast", 10, 10)
+    store.take("ip:other", 10, 10)
+    clock.now += 2
+    store.take("ip:new", 10, 10)
+    # the fast buckets refilled and went; the slow one is still spent
+    assert len(store) == 2
+    assert store.take("username:slow", 1, 0.01)[0] is False
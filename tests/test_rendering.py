@@ -0,0 +1,43 @@
+# tests/test_rendering.py
+
+import gzip
+
+from rendering import Encoded
+
+BODY = b"<p>" + b"hello " * 100 + b"</p>"
+
+
+def page():
+    encoded = Encoded.build(BODY, "text/html; charset=utf-8")
+    # stands in for brotli when the package is not installed
+    encoded.br = encoded.br or b"br-bytes"
+    return encoded
+
+
+def test_each_encoding_has_its_own_etag():
+    encoded = page()
+    plain = encoded.respond({}, "no-cache")
+    gzipped = encoded.respond({"accept-encoding": "gzip"}, "no-cache")
+    brotlied = encoded.respond({"accept-encoding": "gzip, br"}, "no-cache")
+
+    assert gzip.decompress(gzipped.body) == BODY
+    assert len({plain.headers["etag"], gzipped.headers["etag"], brotlied.headers["etag"]}) == 3
+    assert gzipped.headers["etag"].endswith('-gz"')
+
+
+def test_revalidates_any_cached_representation():
+    encoded = page()
+    gz_etag = encoded.respond({"accept-encoding": "gzip"}, "no-cache").headers["etag"]
+
+    response = encoded.respond({"accept-encoding": "gzip", "if-none-match": gz_etag}, "no-cache")
+    assert response.status_code == 304
+    assert response.headers["etag"] == gz_etag
+    assert encoded.respond({"if-none-match": '"other"'}, "no-cache").status_code == 200
+
+
+def test_q_zero_refuses_an_encoding():
+    encoded = page()
+    assert encoded.negotiate({"accept-encoding": "br;q=0, gzip"})[1] == "gzip"
+    assert encoded.negotiate({"accept-encoding": "br;q=0, gzip;q=0"})[1] is None
+    assert encoded.negotiate({"accept-encoding": "*;q=0.5, br;q=0"})[1] == "gzip"
+    assert encoded.negotiate({"accept-encoding": "identity"})[1] is None
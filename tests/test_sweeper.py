@@ -0,0 +1,54 @@
+# tests/test_sweeper.py
+
+import pytest
+from sqlalchemy import delete
+
+from connection import write_engine
+from migrations import upgrade
+from models import UserModel
+from sweeper import Sweeper, utcnow
+
+
+@pytest.fixture
+def stale_users():
+    upgrade()
+    with write_engine.begin() as conn:
+        conn.execute(delete(UserModel))
+        # stored as CURRENT_TIMESTAMP text; several rows share a second,
+        # so the id breaks ties
+        conn.exec_driver_sql(
+            "INSERT INTO users (username, email, password, is_active, role, created_at) "
+            "VALUES (?, ?, 'x', 0, 'user', ?)",
+            [(f"stale{i}", f"stale{i}@example.com", f"2020-01-01 00:00:{i // 3:02d}") for i in range(10)])
+    yield
+    with write_engine.begin() as conn:
+        conn.execute(delete(UserModel))
+
+
+def test_batches_follow_the_keyset(stale_users):
+    sweeper = Sweeper(batch_size=4)
+    cutoff = utcnow()
+    first = sweeper._next_batch(cutoff, None)
+    second = sweeper._next_batch(cutoff, tuple(first[-1]))
+    third = sweeper._next_batch(cutoff, tuple(second[-1]))
+
+    assert [len(first), len(second), len(third)] == [4, 4, 2]
+    assert tuple(second[0]) > tuple(first[-1])
+    ids = [row.id for row in first + second + third]
+    assert len(set(ids)) == 10
+
+
+def test_sweep_removes_only_stale_unverified(stale_users):
+    with write_engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO users (username, email, password, is_active, role, created_at) "
+            "VALUES ('active', 'active@example.com', 'x', 1, 'user', '2020-01-01 00:00:00')")
+        conn.execute(UserModel.__table__.insert(),
+                     {"username": "fresh", "email": "fresh@example.com", "password": "x", "is_active": False})
+
+    sweeper = Sweeper(batch_size=3, rows_per_second=1e9)
+    assert sweeper.sweep() == 10
+    assert sweeper.batches == 4
+    with write_engine.connect() as conn:
+        left = {row.username for row in conn.execute(UserModel.__table__.select())}
+    assert left == {"active", "fresh"}
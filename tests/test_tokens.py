@@ -0,0 +1,61 @@
+# tests/test_tokens.py
+
+import time
+
+import pytest
+from jose import JWTError
+
+import tokens
+from scurity import JWT_ALGORITHM, JWT_SECRET, verify_token
+from tokens import JoseBackend, PyJWTBackend, TokenCache, token_cache
+
+
+@pytest.mark.parametrize("backend", [JoseBackend, PyJWTBackend])
+def test_expired_token_is_rejected_as_jwt_error(backend):
+    backend = backend()
+    token = backend.encode({"username": "u", "exp": int(time.time()) - 10}, key=JWT_SECRET, algorithm=JWT_ALGORITHM)
+    with pytest.raises(JWTError):
+        backend.decode(token, key=JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+def test_cached_entry_is_dropped_at_exp(monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(tokens.time, "time", lambda: now)
+    cache = TokenCache(max_ttl=300)
+    cache.put("short", {"exp": now + 10})
+    cache.put("no-exp", {})
+
+    now += 11
+    assert cache.get("short") is None
+    assert cache.get("no-exp") == {}
+
+    now += 300
+    assert cache.get("no-exp") is None
+
+
+def test_tampered_token_is_never_served_from_the_cache():
+    token_cache.clear()
+    good = tokens.jwt_backend.encode({"username": "user", "role": "user", "exp": int(time.time()) + 60},
+                                     key=JWT_SECRET, algorithm=JWT_ALGORITHM)
+    admin = tokens.jwt_backend.encode({"username": "user", "role": "admin", "exp": int(time.time()) + 60},
+                                      key="not-the-secret", algorithm=JWT_ALGORITHM)
+    assert verify_token(good)["role"] == "user"
+
+    # the admin payload under the cached token's signature
+    header, _, signature = good.split(".")
+    tampered = ".".join([header, admin.split(".")[1], signature])
+    with pytest.raises(JWTError):
+        verify_token(tampered)
+    assert token_cache.get(tampered) is None
+    assert verify_token(good)["role"] == "user"
+
+
+def test_expired_token_is_not_served_from_the_cache(monkeypatch):
+    token_cache.clear()
+    now = time.time()
+    token = tokens.jwt_backend.encode({"username": "user", "exp": int(now) + 5},
+                                      key=JWT_SECRET, algorithm=JWT_ALGORITHM)
+    assert verify_token(token)["username"] == "user"
+
+    monkeypatch.setattr(tokens.time, "time", lambda: now + 10)
+    assert token_cache.get(token) is None
@@ -0,0 +1,49 @@
+# tests/test_verify.py
+
+from sqlalchemy import delete, select
+
+from connection import write_engine
+from models import UserModel
+from schema import Roles
+from scurity import create_access_token, create_verification_token
+from usercache import UserRecord
+
+
+def signed_up(username):
+    with write_engine.begin() as conn:
+        conn.execute(delete(UserModel).where(UserModel.username == username))
+        user_id = conn.execute(UserModel.__table__.insert().returning(UserModel.id),
+                               {"username": username, "email": f"{username}@example.com",
+                                "password": "x", "is_active": False}).scalar_one()
+    return UserRecord(user_id, username, f"{username}@example.com", "x", False, Roles.user)
+
+
+def is_active(username):
+    with write_engine.connect() as conn:
+        return conn.execute(select(UserModel.is_active).where(UserModel.username == username)).scalar()
+
+
+def test_first_click_activates_and_repeat_is_a_no_op(client):
+    token = create_verification_token(signed_up("clicker"))
+
+    first = client.get(f"/user/verify/{token}", follow_redirects=False)
+    assert first.status_code == 307
+    assert first.headers["location"] == "/user/signin"
+    assert is_active("clicker")
+
+    again = client.get(f"/user/verify/{token}", follow_redirects=False)
+    assert again.status_code == 200
+    assert again.json() == "User verified successfully."
+
+
+def test_unknown_user_is_rejected(client):
+    ghost = UserRecord(0, "ghost", "ghost@example.com", "x", False, Roles.user)
+    response = client.get(f"/user/verify/{create_verification_token(ghost)}")
+    assert response.status_code == 400
+
+
+def test_access_token_does_not_verify(client):
+    user = signed_up("signedin")
+    response = client.get(f"/user/verify/{create_access_token(user)}")
+    assert response.status_code == 400
+    assert not is_active("signedin")
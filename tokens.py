@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+# tokens.py
+#
+# JWT encode/decode backends and a cache of already verified tokens
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from jose import JWTError
+
+JWT_BACKEND = os.environ.get("JWT_BACKEND", "auto")  # auto | pyjwt | jose
+JWT_CACHE_SIZE = int(os.environ.get("JWT_CACHE_SIZE", 10000))
+# upper bound for tokens issued before they carried an exp claim
+JWT_CACHE_MAX_TTL = float(os.environ.get("JWT_CACHE_MAX_TTL", 300))
+
+
+# jose.jwt pulls in its crypto backends, only imported when actually used
+class JoseBackend:
+    name = "jose"
+
+    def __init__(self):
+        from jose import jwt
+        self.jwt = jwt
+
+    def encode(self, payload: Dict, key: str, algorithm: str) -> str:
+        return self.jwt.encode(payload, key=key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithm: str) -> Dict:
+        return self.jwt.decode(token, key=key, algorithms=[algorithm])
+
+
+# PyJWT does far less work per call than python-jose
+class PyJWTBackend:
+    name = "pyjwt"
+
+    def __init__(self):
+        import jwt
+        self.jwt = jwt
+
+    def encode(self, payload: Dict, key: str, algorithm: str) -> str:
+        return self.jwt.encode(payload, key=key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithm: str) -> Dict:
+        try:
+            return self.jwt.decode(token, key=key, algorithms=[algorithm])
+        except self.jwt.PyJWTError as ex:
+            raise JWTError(str(ex))
+
+
+def make_backend(kind: str = JWT_BACKEND):
+    if kind in ("auto", "pyjwt"):
+        try:
+            return PyJWTBackend()
+        except ImportError:
+            if kind == "pyjwt":
+                raise RuntimeError("JWT_BACKEND=pyjwt needs the PyJWT package (pip install PyJWT)")
+    return JoseBackend()
+
+
+# token string -> payload for tokens whose signature was already checked,
+# dropped once the token expires
+class TokenCache:
+    def __init__(self, maxsize: int = JWT_CACHE_SIZE, max_ttl: float = JWT_CACHE_MAX_TTL):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._data[token]
+                self.misses += 1
+                return None
+            self._data.move_to_end(token)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, token: str, payload: Dict):
+        expires = time.time() + self.max_ttl
+        if "exp" in payload:
+            expires = min(expires, float(payload["exp"]))
+        with self._lock:
+            self._data[token] = (expires, dict(payload))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._data)}
+
+
+jwt_backend = make_backend()
+token_cache = TokenCache()
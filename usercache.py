@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+# usercache.py
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from schema import Roles
+
+USER_CACHE_BACKEND = os.environ.get("USER_CACHE_BACKEND", "memory")  # memory | redis | none
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_REDIS_URL = os.environ.get("USER_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+
+# what the auth flow needs from a user row, without the ORM instance
+@dataclass(frozen=True, slots=True)
+class UserRecord:
+    id: int
+    username: str
+    email: str
+    password: str
+    is_active: bool
+    role: Roles
+
+    def dumps(self) -> str:
+        data = asdict(self)
+        data["role"] = self.role.value
+        return json.dumps(data)
+
+    @classmethod
+    def loads(cls, raw) -> "UserRecord":
+        data = json.loads(raw)
+        data["role"] = Roles(data["role"])
+        return cls(**data)
+
+
+class CacheStats:
+    __slots__ = ("hits", "misses", "evictions", "expirations", "invalidations")
+
+    def __init__(self):
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# TTL + LRU in process memory
+class MemoryBackend:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[UserRecord]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires, record = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return record
+
+    def set(self, key: str, record: UserRecord):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, record)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# shared between uvicorn workers; any client with get/set(ex=)/delete works
+class RedisBackend:
+    def __init__(self, client, ttl: float = USER_CACHE_TTL, prefix: str = "usercache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    @classmethod
+    def from_url(cls, url: str = USER_CACHE_REDIS_URL, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("USER_CACHE_BACKEND=redis needs the redis package (pip install redis)")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key: str) -> Optional[UserRecord]:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return UserRecord.loads(raw)
+
+    def set(self, key: str, record: UserRecord):
+        self.client.set(self.prefix + key, record.dumps(), ex=max(1, int(self.ttl)))
+
+    def delete(self, key: str):
+        if self.client.delete(self.prefix + key):
+            self.stats.invalidations += 1
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class NullBackend:
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key):
+        self.stats.misses += 1
+        return None
+
+    def set(self, key, record):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+# records are stored under both their username and their email
+class UserCache:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_by_username(self, username: str) -> Optional[UserRecord]:
+        return self.backend.get("u:" + username)
+
+    def get_by_email(self, email: str) -> Optional[UserRecord]:
+        return self.backend.get("e:" + email)
+
+    def put(self, record: Optional[UserRecord]) -> Optional[UserRecord]:
+        if record is not None:
+            self.backend.set("u:" + record.username, record)
+            self.backend.set("e:" + record.email, record)
+        return record
+
+    def invalidate(self, username: Optional[str] = None, email: Optional[str] = None):
+        if username is not None:
+            self.backend.delete("u:" + username)
+        if email is not None:
+            self.backend.delete("e:" + email)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats.as_dict()
+
+
+def make_backend(kind: str = USER_CACHE_BACKEND):
+    if kind == "redis":
+        return RedisBackend.from_url()
+    if kind == "none":
+        return NullBackend()
+    return MemoryBackend()
+
+
+user_cache = UserCache(make_backend())